@@ -1,13 +1,27 @@
 import os
+import atexit
 import logging
+import logging.handlers
+import queue
+import re
 import sys
-from datetime import datetime, timedelta
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+from datetime import date
 import asyncio
+import contextvars
+import functools
+import gzip
+import html
 from typing import Optional, List
 
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
 from aiogram.filters import CommandStart, Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -19,12 +33,23 @@ from aiogram.types import (
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiohttp import web
 import asyncpg
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+import orjson
+import uvloop
+
+# Настройка логирования: хендлеры только кладут запись в очередь,
+# а в stderr пишет фоновый поток, чтобы вывод не блокировал цикл событий
+log_queue = queue.SimpleQueue()
+log_stream_handler = logging.StreamHandler()
+log_stream_handler.setFormatter(
+    logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 )
+log_listener = logging.handlers.QueueListener(log_queue, log_stream_handler)
+logging.root.addHandler(logging.handlers.QueueHandler(log_queue))
+# В проде уровень можно поднять до WARNING, не трогая код. Трассировка входящих
+# команд и нажатий пишется на DEBUG и при INFO не доходит даже до очереди
+logging.root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # Конфигурация
@@ -46,22 +71,126 @@ if not WEBHOOK_HOST:
 
 WEBHOOK_PATH = "/webhook"
 WEBHOOK_URL = f"https://{WEBHOOK_HOST}{WEBHOOK_PATH}"
+WEBHOOK_MAX_CONNECTIONS = 40
+
+# Размер пула БД; по умолчанию максимум совпадает с параллельностью вебхука,
+# а в простое держим пару подключений, не занимая лимит соединений базы
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 2))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", WEBHOOK_MAX_CONNECTIONS))
 
-logger.info(f"🚀 Конфигурация:")
-logger.info(f"• PORT: {PORT}")
-logger.info(f"• WEBHOOK_HOST: {WEBHOOK_HOST}")
-logger.info(f"• WEBHOOK_URL: {WEBHOOK_URL}")
+logger.info("🚀 Конфигурация:")
+logger.info("• PORT: %s", PORT)
+logger.info("• WEBHOOK_HOST: %s", WEBHOOK_HOST)
+logger.info("• WEBHOOK_URL: %s", WEBHOOK_URL)
+logger.info("• DB pool: %s-%s", DB_POOL_MIN, DB_POOL_MAX)
 
 # Ваш Telegram ID
 TELEGRAM_USER_ID = 209010651
 
+class TelegramRateLimiter(BaseRequestMiddleware):
+    """Сглаживание исходящих сообщений под лимиты Bot API"""
+
+    def __init__(self, global_per_second: int = 30, group_per_minute: int = 20):
+        self.global_interval = 1 / global_per_second
+        self.group_interval = 60 / group_per_minute
+        self.global_next = 0.0
+        self.group_next = {}
+
+    def reserve(self, chat_id) -> float:
+        """Бронирует слот отправки и возвращает, сколько нужно подождать"""
+        now = asyncio.get_running_loop().time()
+        start = max(now, self.global_next)
+        
+        # Личные чаты допускают короткие серии сообщений, а для групп
+        # Telegram ограничивает около 20 сообщений в минуту
+        if isinstance(chat_id, str) or chat_id < 0:
+            if len(self.group_next) > 1000:
+                self.group_next = {k: t for k, t in self.group_next.items() if t > now}
+            start = max(start, self.group_next.get(chat_id, 0.0))
+            self.group_next[chat_id] = start + self.group_interval
+        
+        self.global_next = start + self.global_interval
+        return start - now
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is not None:
+            delay = self.reserve(chat_id)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            # Telegram всё же ограничил: притормаживаем все отправки и повторяем один раз
+            logger.warning("⏳ Flood control, пауза %s сек.", e.retry_after)
+            loop_time = asyncio.get_running_loop().time()
+            self.global_next = max(self.global_next, loop_time + e.retry_after)
+            await asyncio.sleep(e.retry_after)
+            return await make_request(bot, method)
+
 # Инициализация
-bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+# SimpleRequestHandler разбирает тело вебхука через bot.session.json_loads,
+# поэтому orjson ускоряет и входящие апдейты, и ответы Bot API.
+# json_dumps сериализует reply_markup в исходящих запросах и должен вернуть str
+def orjson_dumps(value) -> str:
+    return orjson.dumps(value).decode()
+
+class TelegramSession(AiohttpSession):
+    """AiohttpSession с настройками TCPConnector под единственный хост Bot API"""
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Публичного способа передать параметры коннектора aiogram не даёт: аргументы
+        # TCPConnector лежат в _connector_init (aiogram закреплён в requirements.txt).
+        # Если атрибут пропадёт после обновления, падаем при старте, а не теряем настройку молча
+        connector_init = getattr(self, "_connector_init", None)
+        if not isinstance(connector_init, dict):
+            raise RuntimeError("AiohttpSession._connector_init не найден: проверьте версию aiogram")
+        # Все запросы идут на один хост api.telegram.org: держим TLS-соединения тёплыми
+        # дольше минутного тика планировщика, чтобы не платить за повторный хендшейк
+        connector_init.update(limit_per_host=50, keepalive_timeout=75)
+
+session = TelegramSession(limit=100, json_loads=orjson.loads, json_dumps=orjson_dumps)
+session.middleware(TelegramRateLimiter())
+bot = Bot(token=TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher()
 
+# Текущая дата, одна на весь апдейт: хендлеры берут её через TODAY.get()
+TODAY: contextvars.ContextVar[date] = contextvars.ContextVar('today')
+
+@dp.update.outer_middleware()
+async def today_middleware(handler, event, data):
+    """Фиксирует сегодняшнюю дату перед обработкой апдейта"""
+    TODAY.set(date.today())
+    return await handler(event, data)
+
+# Вебхук отвечает Telegram сразу (handle_in_background), и aiogram заводит задачу
+# на каждый апдейт. Семафор ограничивает только одновременную работу хендлеров
+# с БД и Bot API, а не число принятых апдейтов — его держит WebhookHandler
+MAX_UPDATES_IN_FLIGHT = 500
+updates_in_flight = asyncio.Semaphore(MAX_UPDATES_IN_FLIGHT)
+# Принятые, но ещё не обработанные апдейты, включая ждущих семафора
+MAX_UPDATES_PENDING = 2000
+updates_pending = 0
+
+@dp.update.outer_middleware()
+async def in_flight_middleware(handler, event, data):
+    """Ограничивает число одновременно обрабатываемых апдейтов"""
+    global updates_pending
+    updates_pending += 1
+    try:
+        async with updates_in_flight:
+            return await handler(event, data)
+    finally:
+        updates_pending -= 1
+
 # Глобальные переменные
 db_pool = None
 notification_task = None
+overdue_task = None
+listener_task = None
+# Фоновые задачи из хендлеров: event loop держит на них только слабые ссылки
+background_tasks = set()
 
 # Статусы задач
 TASK_STATUSES = {
@@ -71,6 +200,22 @@ TASK_STATUSES = {
     'overdue': '⚠️ Просрочена'
 }
 
+# Иконки статусов для списков задач (только для чтения)
+STATUS_ICONS = MappingProxyType({
+    'pending': '⏳',
+    'in_progress': '🔄',
+    'completed': '✅',
+    'overdue': '⚠️'
+})
+
+# Уведомления, которые автоматически создаются для новой задачи: (тип, за сколько дней)
+NOTIFICATION_SCHEDULE = (
+    ("days_before_3", 3),
+    ("days_before_2", 2),
+    ("days_before_1", 1),
+    ("deadline_today", 0),
+)
+
 # FSM States
 class ProjectState(StatesGroup):
     waiting_for_name = State()
@@ -80,54 +225,107 @@ class TaskState(StatesGroup):
     waiting_for_deadline = State()
 
 # ========== БАЗА ДАННЫХ ==========
+async def skip_connection_reset(conn):
+    """Сброс сессии при возврате подключения в пул не нужен"""
+    # Хендлеры не меняют настройки сессии, не делают LISTEN и не берут
+    # advisory-блокировки, а незавершённую транзакцию asyncpg откатит и так.
+    # Без RESET ALL/UNLISTEN и т.д. release не тратит лишний запрос к базе
+
 async def get_db_pool():
     """Создание пула подключений к PostgreSQL"""
     global db_pool
     if db_pool is None:
         try:
             logger.info("🔄 Создание пула подключений к PostgreSQL...")
+            # Telegram держит до WEBHOOK_MAX_CONNECTIONS параллельных запросов к вебхуку:
+            # пул того же размера не заставляет апдейты ждать в pool.acquire()
             db_pool = await asyncpg.create_pool(
                 DATABASE_URL,
-                min_size=1,
-                max_size=10,
-                command_timeout=60
+                min_size=DB_POOL_MIN,
+                max_size=DB_POOL_MAX,
+                # Пиковые подключения живут 10 минут: всплеск нажатий после паузы
+                # не платит за новое подключение к базе
+                max_inactive_connection_lifetime=600,
+                command_timeout=60,
+                # Набор запросов фиксирован: подготовленные выражения держим, пока живёт соединение
+                statement_cache_size=1024,
+                max_cached_statement_lifetime=0,
+                reset=skip_connection_reset,
+                # JIT-компиляция только добавляет задержку коротким OLTP-запросам бота
+                server_settings={
+                    'jit': 'off',
+                    'search_path': 'public',
+                    'application_name': 'projecttuva_bot'
+                }
             )
             logger.info("✅ Пул подключений создан")
         except Exception as e:
-            logger.error(f"❌ Ошибка при создании пула подключений: {e}")
+            logger.error("❌ Ошибка при создании пула подключений: %s", e)
             raise
     return db_pool
 
+# Имена проектов меняются редко: держим их в памяти, чтобы навигация по
+# задачам не ходила в БД за проверкой доступа на каждый callback
+PROJECT_CACHE_TTL = 60
+PROJECT_CACHE_MAX_SIZE = 10000
+project_name_cache = {}
+
+async def load_project_name(conn, project_id: int, user_id: int) -> Optional[str]:
+    """Имя проекта из БД с записью в кеш"""
+    name = await conn.fetchval(PROJECT_NAME_SQL, project_id, user_id)
+    if name is not None:
+        # Имя нужно только для текста сообщений: экранируем один раз на время жизни записи
+        name = html.escape(name, quote=False)
+        now = time.monotonic()
+        if len(project_name_cache) > PROJECT_CACHE_MAX_SIZE:
+            # Выкидываем протухшие записи, чтобы кеш не рос бесконечно
+            for stale_key in [k for k, (_, expires) in project_name_cache.items() if expires <= now]:
+                del project_name_cache[stale_key]
+        project_name_cache[(project_id, user_id)] = (name, now + PROJECT_CACHE_TTL)
+    return name
+
+# Промахи кеша, по которым запрос уже идёт: повторные нажатия той же кнопки,
+# пришедшие до ответа БД, ждут его вместо собственного запроса
+project_name_loads = {}
+
+async def get_project_name(conn, project_id: int, user_id: int) -> Optional[str]:
+    """Имя проекта пользователя (уже экранированное для HTML) или None, если проекта нет или он чужой"""
+    key = (project_id, user_id)
+    cached = project_name_cache.get(key)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    
+    pending = project_name_loads.get(key)
+    if pending is not None:
+        # shield: отмена ожидающего апдейта не должна обрывать чужой запрос
+        return await asyncio.shield(pending)
+    
+    load = asyncio.ensure_future(load_project_name(conn, project_id, user_id))
+    project_name_loads[key] = load
+    load.add_done_callback(lambda _: project_name_loads.pop(key, None))
+    return await load
+
 async def migrate_web_data():
     """Миграция данных из веб-версии на ваш Telegram ID"""
     try:
         pool = await get_db_pool()
         async with pool.acquire() as conn:
-            # 1. Обновляем все проекты с user_id = 1 на ваш Telegram ID
-            result = await conn.execute('''
-                UPDATE projects 
-                SET user_id = $1 
-                WHERE user_id = 1 OR user_id IS NULL
-            ''', TELEGRAM_USER_ID)
-            
-            projects_updated = int(result.split()[1]) if 'UPDATE' in result else 0
+            # Переносим проекты с user_id = 1 на ваш Telegram ID и сразу считаем задачи.
+            # Снимок запроса не видит результат UPDATE, поэтому перенесённые проекты
+            # берём из RETURNING, а уже принадлежавшие — из таблицы
+            result = await conn.fetchrow(MIGRATE_WEB_DATA_SQL, TELEGRAM_USER_ID)
             
-            # 2. Получаем количество мигрированных задач
-            tasks_count = await conn.fetchval('''
-                SELECT COUNT(*) 
-                FROM tasks t
-                JOIN projects p ON t.project_id = p.id
-                WHERE p.user_id = $1
-            ''', TELEGRAM_USER_ID)
+            projects_updated = result['projects_updated']
+            tasks_count = result['tasks_count']
             
-            logger.info(f"✅ Мигрировано {projects_updated} проектов и {tasks_count} задач на ID {TELEGRAM_USER_ID}")
+            logger.info("✅ Мигрировано %s проектов и %s задач на ID %s", projects_updated, tasks_count, TELEGRAM_USER_ID)
             return {
                 'success': True,
                 'projects_updated': projects_updated,
                 'tasks_count': tasks_count
             }
     except Exception as e:
-        logger.error(f"❌ Ошибка миграции данных: {e}")
+        logger.error("❌ Ошибка миграции данных: %s", e)
         return {
             'success': False,
             'error': str(e)
@@ -180,17 +378,40 @@ async def create_tables():
                 )
             ''')
             
-            # Создаем индексы для производительности
+            # Создаем индексы для производительности.
+            # Поиск задач по project_id обслуживает idx_tasks_project_deadline_id,
+            # отдельный индекс только удорожал запись
             await conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_tasks_project_id ON tasks(project_id)
+                DROP INDEX IF EXISTS idx_tasks_project_id
             ''')
             
             await conn.execute('''
                 CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status)
             ''')
             
+            # Ночной перевод в 'overdue' ищет по дедлайну только незакрытые задачи:
+            # частичный индекс не растёт за счёт завершённых и уже просроченных
             await conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_tasks_deadline ON tasks(deadline)
+                CREATE INDEX IF NOT EXISTS idx_tasks_deadline_active
+                ON tasks(deadline) WHERE status NOT IN ('completed', 'overdue')
+            ''')
+            await conn.execute('''
+                DROP INDEX IF EXISTS idx_tasks_deadline
+            ''')
+            
+            # Проекты пользователя: фильтр, порядок и имя берутся прямо из индекса
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_projects_user_created
+                ON projects(user_id, created_at DESC) INCLUDE (name)
+            ''')
+            
+            # Списки задач проекта сортируются по дедлайну и листаются по ключу
+            # (deadline, id): страница — это короткий диапазон индекса без сортировки
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_tasks_project_deadline_id ON tasks(project_id, deadline, id)
+            ''')
+            await conn.execute('''
+                DROP INDEX IF EXISTS idx_tasks_project_deadline
             ''')
             
             await conn.execute('''
@@ -198,155 +419,416 @@ async def create_tables():
                 ON notifications(user_id, notification_time) WHERE is_sent = FALSE
             ''')
             
+            # Индекс под выборку планировщика: только неотправленные, по времени
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_notifications_due
+                ON notifications(notification_time) WHERE is_sent = FALSE
+            ''')
+            
+            # Неотправленные уведомления задачи: проверка дублей при вставке и
+            # соединение с задачами в списке уведомлений. Индекс не уникальный —
+            # веб-версия пишет в таблицу обычным INSERT, дубли отсекает только бот
+            await conn.execute('''
+                DROP INDEX IF EXISTS idx_notifications_task_type
+            ''')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_notifications_task_pending
+                ON notifications(task_id, notification_type) WHERE is_sent = FALSE
+            ''')
+            
+            # Любая вставка уведомлений (в том числе из веб-версии) шлёт NOTIFY после
+            # коммита; триггер на уровне оператора — один сигнал на весь INSERT.
+            # Пересоздаём в одной транзакции: DROP TRIGGER первым берёт блокировку
+            # таблицы, поэтому одновременно стартующие инстансы выполняют это по
+            # очереди, а вставки ждут коммита и не остаются без NOTIFY
+            async with conn.transaction():
+                await conn.execute('''
+                    DROP TRIGGER IF EXISTS notifications_changed_notify ON notifications
+                ''')
+                await conn.execute('''
+                    CREATE OR REPLACE FUNCTION notify_notifications_changed() RETURNS trigger AS $$
+                    BEGIN
+                        PERFORM pg_notify('notifications_changed', '');
+                        RETURN NULL;
+                    END
+                    $$ LANGUAGE plpgsql
+                ''')
+                await conn.execute('''
+                    CREATE TRIGGER notifications_changed_notify
+                    AFTER INSERT ON notifications
+                    FOR EACH STATEMENT EXECUTE FUNCTION notify_notifications_changed()
+                ''')
+            
             logger.info("✅ Таблицы созданы/проверены")
             return True
             
     except Exception as e:
-        logger.error(f"❌ Ошибка при создании таблиц: {e}")
+        logger.error("❌ Ошибка при создании таблиц: %s", e)
         return False
 
 # ========== УВЕДОМЛЕНИЯ ==========
-async def create_notification(user_id: int, task_id: int, notification_type: str, days_before: int = 0):
-    """Создание уведомления"""
-    try:
-        pool = await get_db_pool()
-        async with pool.acquire() as conn:
-            task = await conn.fetchrow(
-                "SELECT deadline FROM tasks WHERE id = $1",
-                task_id
-            )
-            
-            if not task:
-                logger.error(f"❌ Задача {task_id} не найдена для создания уведомления")
-                return
-            
-            deadline = task['deadline']
-            notification_time = datetime.combine(deadline, datetime.min.time().replace(hour=9, minute=0)) - timedelta(days=days_before)
-            
-            # Проверяем, не существует ли уже такое уведомление
-            existing = await conn.fetchrow('''
-                SELECT id FROM notifications 
-                WHERE task_id = $1 AND notification_type = $2 AND is_sent = FALSE
-                AND ABS(EXTRACT(EPOCH FROM (notification_time - $3))) < 60
-            ''', task_id, notification_type, notification_time)
-            
-            if existing:
-                logger.info(f"ℹ️ Уведомление уже существует для задачи {task_id} ({notification_type})")
-                return
-            
-            await conn.execute('''
-                INSERT INTO notifications (user_id, task_id, notification_type, notification_time)
-                VALUES ($1, $2, $3, $4)
-            ''', user_id, task_id, notification_type, notification_time)
-            
-            logger.info(f"📅 Уведомление создано для задачи {task_id} ({notification_type}) на {notification_time}")
-            
-    except Exception as e:
-        logger.error(f"❌ Ошибка создания уведомления для задачи {task_id}: {e}")
+# Время уведомления считается в SQL от дедлайна задачи, доступ проверяется тем же
+# запросом, а уже стоящее неотправленное уведомление того же типа не дублируется
+CREATE_NOTIFICATIONS_SQL = '''
+    WITH task AS (
+        SELECT t.deadline FROM tasks t
+        JOIN projects p ON t.project_id = p.id
+        WHERE t.id = $2 AND p.user_id = $1
+    ), inserted AS (
+        INSERT INTO notifications (user_id, task_id, notification_type, notification_time)
+        SELECT $1, $2, s.notification_type, s.notification_time
+        FROM task, LATERAL (
+            SELECT u.notification_type,
+                   task.deadline + TIME '09:00' - make_interval(days => u.days_before) as notification_time
+            FROM unnest($3::text[], $4::int[]) AS u(notification_type, days_before)
+        ) s
+        WHERE (NOT $5::bool OR s.notification_time > NOW())
+        AND NOT EXISTS (
+            SELECT 1 FROM notifications d
+            WHERE d.task_id = $2
+            AND d.notification_type = s.notification_type
+            AND d.is_sent = FALSE
+        )
+        RETURNING notification_type
+    )
+    SELECT
+        EXISTS (SELECT 1 FROM task) as task_exists,
+        ARRAY(SELECT notification_type FROM inserted) as created
+'''
+
+# Новая задача и её уведомления по NOTIFICATION_SCHEDULE одним выражением:
+# отдельная транзакция и второй запрос не нужны. Уже прошедшие не создаём,
+# чтобы планировщик не разослал их разом
+ADD_TASK_SQL = '''
+    WITH task AS (
+        INSERT INTO tasks (project_id, title, deadline, status)
+        VALUES ($1, $2, $3, CASE WHEN $3 < CURRENT_DATE THEN 'overdue' ELSE 'pending' END)
+        RETURNING id, deadline
+    ), inserted AS (
+        INSERT INTO notifications (user_id, task_id, notification_type, notification_time)
+        SELECT $4, task.id, s.notification_type, s.notification_time
+        FROM task, LATERAL (
+            SELECT u.notification_type,
+                   task.deadline + TIME '09:00' - make_interval(days => u.days_before) as notification_time
+            FROM unnest($5::text[], $6::int[]) AS u(notification_type, days_before)
+        ) s
+        WHERE s.notification_time > NOW()
+        RETURNING notification_type
+    )
+    SELECT
+        (SELECT id FROM task) as id,
+        ARRAY(SELECT notification_type FROM inserted) as created
+'''
+SCHEDULE_TYPES = [notification_type for notification_type, _ in NOTIFICATION_SCHEDULE]
+SCHEDULE_DAYS = [days for _, days in NOTIFICATION_SCHEDULE]
+
+def reminder_label(days: int) -> str:
+    """«за N дней» с нужным окончанием или «в день дедлайна»"""
+    if days == 0:
+        return "в день дедлайна"
+    if days % 10 == 1 and days % 100 != 11:
+        return f"за {days} день"
+    if days % 10 in (2, 3, 4) and days % 100 not in (12, 13, 14):
+        return f"за {days} дня"
+    return f"за {days} дней"
+
+# Подписи уведомлений новой задачи в порядке расписания
+SCHEDULE_LABELS = MappingProxyType({
+    notification_type: reminder_label(days) for notification_type, days in NOTIFICATION_SCHEDULE
+})
+
+async def create_notifications(conn, user_id: int, task_id: int, schedule, skip_past: bool = True) -> Optional[List[str]]:
+    """Уведомления задачи по расписанию (тип, дней до дедлайна); None, если задачи нет или она чужая"""
+    # skip_past не создаёт уже прошедшие, чтобы планировщик не разослал их разом.
+    # notifications_changed выставляет вызывающий: после коммита, иначе планировщик их не увидит
+    notification_types = [notification_type for notification_type, _ in schedule]
+    days_before = [days for _, days in schedule]
+    result = await conn.fetchrow(
+        CREATE_NOTIFICATIONS_SQL, user_id, task_id, notification_types, days_before, skip_past
+    )
+    
+    if not result['task_exists']:
+        return None
+    
+    created = result['created']
+    if created:
+        logger.info("📅 Уведомления созданы для задачи %s: %s", task_id, ", ".join(created))
+    else:
+        logger.debug("ℹ️ Новых уведомлений для задачи %s нет", task_id)
+    return created
+
+# Сколько уведомлений планировщик забирает за один проход
+NOTIFICATION_BATCH_SIZE = 50
+
+# Забираем наступившие уведомления одним запросом: строки сразу помечаются
+# отправленными и коммитятся, поэтому транзакция не висит на время запросов
+# к Telegram, а SKIP LOCKED не даёт двум инстансам взять одни и те же строки.
+# Строки без задачи (их может записать веб-версия) отправить некому: их не
+# берём, чтобы они не занимали пачку
+CLAIM_DUE_NOTIFICATIONS_SQL = f'''
+    WITH claimed AS (
+        SELECT id FROM notifications
+        WHERE is_sent = FALSE
+        AND task_id IS NOT NULL
+        AND notification_time <= NOW()
+        ORDER BY notification_time
+        LIMIT {NOTIFICATION_BATCH_SIZE}
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE notifications n
+    SET is_sent = TRUE
+    FROM claimed, tasks t
+    JOIN projects p ON t.project_id = p.id
+    WHERE n.id = claimed.id AND t.id = n.task_id
+    RETURNING n.id, n.notification_type, n.notification_time, t.title,
+              TO_CHAR(t.deadline, 'DD.MM.YYYY') as deadline_str,
+              t.deadline - n.notification_time::date as days_left, p.user_id
+'''
+
+# Неотправленные из-за временной ошибки возвращаем в очередь с повтором через минуту.
+# Если за это время появилось такое же неотправленное уведомление, старое не
+# возвращаем, чтобы не прислать одно напоминание дважды
+RELEASE_NOTIFICATIONS_SQL = '''
+    UPDATE notifications n
+    SET is_sent = FALSE,
+        notification_time = NOW() + INTERVAL '1 minute'
+    WHERE n.id = ANY($1::int[])
+    AND NOT EXISTS (
+        SELECT 1 FROM notifications d
+        WHERE d.task_id = n.task_id
+        AND d.notification_type = n.notification_type
+        AND d.is_sent = FALSE
+    )
+'''
+
+# Тексты уведомлений: шаблон выбирается одним поиском по notification_type,
+# все days_before_N из NOTIFICATION_SCHEDULE делят один шаблон
+DAYS_BEFORE_TEMPLATE = "📢 <b>Напоминание</b>\n\nЗадача: {title}\nДедлайн: {deadline}\nОсталось дней: {days}"
+NOTIFICATION_TEMPLATES = MappingProxyType({
+    "deadline_today": "📢 <b>СЕГОДНЯ ДЕДЛАЙН!</b>\n\nЗадача: {title}\nДедлайн: {deadline}",
+    "deadline_tomorrow": "📢 <b>ЗАВТРА ДЕДЛАЙН!</b>\n\nЗадача: {title}\nДедлайн: {deadline}",
+    **{notification_type: DAYS_BEFORE_TEMPLATE for notification_type, days in NOTIFICATION_SCHEDULE if days > 0},
+})
+DEFAULT_NOTIFICATION_TEMPLATE = "📢 <b>Напоминание</b>\n\nЗадача: {title}\nДедлайн: {deadline}"
+
+# Максимальная длина текста сообщения в Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Через сколько секунд наступит ближайшее уведомление, которое возьмёт
+# CLAIM_DUE_NOTIFICATIONS_SQL: фильтр тот же, иначе строка без задачи в прошлом
+# держала бы задержку на нуле. Задача и проект у остальных гарантированы
+# внешними ключами (tasks.project_id NOT NULL)
+NEXT_NOTIFICATION_SQL = '''
+    SELECT EXTRACT(EPOCH FROM MIN(notification_time) - NOW())
+    FROM notifications
+    WHERE is_sent = FALSE
+    AND task_id IS NOT NULL
+'''
+
+# Задачи становятся просроченными только в полночь: помечаем их и заодно
+# узнаём, сколько спать до следующей полуночи по часам БД
+OVERDUE_TASKS_SQL = '''
+    WITH overdue AS (
+        UPDATE tasks
+        SET status = 'overdue',
+            updated_at = CURRENT_TIMESTAMP
+        WHERE deadline < CURRENT_DATE
+        AND status NOT IN ('completed', 'overdue')
+        RETURNING id
+    )
+    SELECT
+        (SELECT COUNT(*) FROM overdue) as updated,
+        EXTRACT(EPOCH FROM (CURRENT_DATE + 1)::timestamptz - NOW()) as seconds_to_midnight
+'''
+
+# Планировщик спит до ближайшего уведомления, но не дольше этого (сек.) —
+# страховка, если LISTEN-соединение недоступно или оборвалось
+NOTIFICATION_MAX_SLEEP = 300
+# ...и не меньше этого: строка, которую выборка всё же не смогла забрать,
+# не превратит цикл планировщика в непрерывный опрос БД
+NOTIFICATION_MIN_SLEEP = 1
+
+# Будит планировщик, когда бот сам добавил уведомления или пришёл NOTIFY из БД
+notifications_changed = asyncio.Event()
+
+# Пауза перед повторным подключением LISTEN растёт от 1 сек. до этого предела
+LISTENER_MAX_RETRY_DELAY = 60
+
+async def notification_listener_loop():
+    """Отдельное соединение с LISTEN: будит планировщик при вставке уведомлений в обход бота"""
+    delay = 1
+    while True:
+        try:
+            # Не из пула: LISTEN держит соединение всё время работы бота
+            conn = await asyncpg.connect(DATABASE_URL)
+            try:
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda _: lost.set())
+                await conn.add_listener(
+                    'notifications_changed', lambda *args: notifications_changed.set()
+                )
+                logger.info("👂 Подписка на notifications_changed оформлена")
+                delay = 1
+                # Пока подписки не было, NOTIFY могли пройти мимо: пусть планировщик перепроверит
+                notifications_changed.set()
+                await lost.wait()
+                logger.warning("⚠️ LISTEN-соединение оборвалось, переподключаемся")
+            finally:
+                if not conn.is_closed():
+                    await conn.close()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("❌ Не удалось подписаться на уведомления БД (повтор через %s сек.): %s", delay, e)
+        
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, LISTENER_MAX_RETRY_DELAY)
+
+async def check_overdue_tasks() -> float:
+    """Пометка просроченных задач; возвращает секунды до следующей полуночи"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        result = await conn.fetchrow(OVERDUE_TASKS_SQL)
+    
+    if result['updated'] > 0:
+        logger.info("🔄 Обновлено %s просроченных задач", result['updated'])
+    return float(result['seconds_to_midnight'])
 
-async def check_overdue_tasks():
-    """Проверка и обновление просроченных задач"""
-    try:
-        pool = await get_db_pool()
-        async with pool.acquire() as conn:
-            result = await conn.execute('''
-                UPDATE tasks 
-                SET status = 'overdue',
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE deadline < CURRENT_DATE 
-                AND status NOT IN ('completed', 'overdue')
-            ''')
-            
-            if 'UPDATE' in result:
-                count = result.split()[1]
-                if int(count) > 0:
-                    logger.info(f"🔄 Обновлено {count} просроченных задач")
-                    
-    except Exception as e:
-        logger.error(f"❌ Ошибка обновления просроченных задач: {e}")
+async def overdue_scheduler():
+    """Ежедневная проверка просроченных задач"""
+    logger.info("⏰ Запуск проверки просроченных задач...")
+    while True:
+        try:
+            delay = await check_overdue_tasks()
+            # Пара секунд запаса, чтобы CURRENT_DATE уже сменилась
+            await asyncio.sleep(delay + 2)
+        except asyncio.CancelledError:
+            logger.info("⏰ Проверка просроченных задач остановлена")
+            break
+        except Exception as e:
+            logger.error("❌ Ошибка обновления просроченных задач: %s", e)
+            await asyncio.sleep(60)
 
-async def check_and_send_notifications():
-    """Проверка и отправка уведомлений"""
+async def get_next_notification_delay() -> float:
+    """Сколько спать планировщику до ближайшего уведомления"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        seconds = await conn.fetchval(NEXT_NOTIFICATION_SQL)
+    
+    if seconds is None:
+        return NOTIFICATION_MAX_SLEEP
+    return min(max(float(seconds), NOTIFICATION_MIN_SLEEP), NOTIFICATION_MAX_SLEEP)
+
+async def check_and_send_notifications() -> int:
+    """Проверка и отправка уведомлений; возвращает, сколько уведомлений забрано"""
     try:
-        await check_overdue_tasks()
-        
         pool = await get_db_pool()
         async with pool.acquire() as conn:
-            notifications = await conn.fetch('''
-                SELECT n.*, t.title, t.deadline, p.user_id
-                FROM notifications n
-                JOIN tasks t ON n.task_id = t.id
-                JOIN projects p ON t.project_id = p.id
-                WHERE n.is_sent = FALSE 
-                AND n.notification_time <= NOW()
-                LIMIT 20
-            ''')
-            
-            sent_count = 0
-            for notification in notifications:
-                user_id = notification['user_id']
-                task_title = notification['title']
-                deadline = notification['deadline'].strftime('%d.%m.%Y')
-                notification_type = notification['notification_type']
-                
-                message_text = ""
-                if notification_type == "deadline_today":
-                    message_text = f"📢 **СЕГОДНЯ ДЕДЛАЙН!**\n\nЗадача: {task_title}\nДедлайн: {deadline}"
-                elif notification_type == "deadline_tomorrow":
-                    message_text = f"📢 **ЗАВТРА ДЕДЛАЙН!**\n\nЗадача: {task_title}\nДедлайн: {deadline}"
-                elif "days_before" in notification_type:
-                    days = notification_type.split("_")[2]
-                    message_text = f"📢 **Напоминание**\n\nЗадача: {task_title}\nДедлайн: {deadline}\nОсталось дней: {days}"
-                else:
-                    message_text = f"📢 **Напоминание**\n\nЗадача: {task_title}\nДедлайн: {deadline}"
-                
-                if message_text:
-                    try:
-                        await bot.send_message(user_id, message_text, parse_mode=ParseMode.MARKDOWN)
-                        await conn.execute(
-                            "UPDATE notifications SET is_sent = TRUE WHERE id = $1",
-                            notification['id']
-                        )
-                        sent_count += 1
-                        logger.info(f"📨 Уведомление отправлено пользователю {user_id} для задачи '{task_title}'")
-                    except Exception as e:
-                        logger.error(f"❌ Ошибка отправки уведомления пользователю {user_id}: {e}")
+            notifications = await conn.fetch(CLAIM_DUE_NOTIFICATIONS_SQL)
+        
+        if not notifications:
+            return 0
+        
+        # RETURNING не сохраняет порядок, поэтому сортируем по времени сами.
+        # Пачки по пользователю: [ids, [тексты], длина]; несколько уведомлений
+        # одного пользователя уходят одним сообщением, если влезают в лимит Telegram
+        batches = {}
+        for notification in sorted(notifications, key=lambda n: n['notification_time']):
+            task_title = notification['title']
+            deadline = notification['deadline_str']
+            template = NOTIFICATION_TEMPLATES.get(notification['notification_type'], DEFAULT_NOTIFICATION_TEMPLATE)
+            text = template.format(
+                title=html.escape(task_title, quote=False), deadline=deadline, days=notification['days_left']
+            )
             
-            if sent_count > 0:
-                logger.info(f"✅ Отправлено {sent_count} уведомлений")
-                        
+            user_batches = batches.setdefault(notification['user_id'], [])
+            if not user_batches or user_batches[-1][2] + len(text) + 2 > TELEGRAM_MESSAGE_LIMIT:
+                user_batches.append([[], [], 0])
+            batch = user_batches[-1]
+            batch[0].append(notification['id'])
+            batch[1].append(text)
+            batch[2] += len(text) + 2
+        
+        outgoing = [
+            (user_id, ids, "\n\n".join(texts))
+            for user_id, user_batches in batches.items()
+            for ids, texts, _ in user_batches
+        ]
+        
+        # Отправляем параллельно: темп под лимиты Telegram держит TelegramRateLimiter
+        results = await asyncio.gather(
+            *(bot.send_message(user_id, text)
+              for user_id, _, text in outgoing),
+            return_exceptions=True,
+        )
+        
+        sent_count = 0
+        retry_ids = []
+        for (user_id, ids, _), result in zip(outgoing, results):
+            if isinstance(result, (TelegramForbiddenError, TelegramBadRequest)):
+                # Бот заблокирован или чата нет: повтор не поможет
+                logger.warning("⚠️ Уведомления пользователю %s не доставлены: %s", user_id, result)
+            elif isinstance(result, Exception):
+                logger.error("❌ Ошибка отправки уведомления пользователю %s: %s", user_id, result)
+                retry_ids.extend(ids)
+            else:
+                sent_count += len(ids)
+                logger.info("📨 Уведомлений отправлено пользователю %s: %s", user_id, len(ids))
+        
+        if retry_ids:
+            async with pool.acquire() as conn:
+                await conn.execute(RELEASE_NOTIFICATIONS_SQL, retry_ids)
+        
+        if sent_count > 0:
+            logger.info("✅ Отправлено %s уведомлений", sent_count)
+        return len(notifications)
+                    
     except Exception as e:
-        logger.error(f"❌ Ошибка проверки уведомлений: {e}")
+        logger.error("❌ Ошибка проверки уведомлений: %s", e)
+        return 0
 
 async def notification_scheduler():
     """Планировщик уведомлений"""
     logger.info("⏰ Запуск планировщика уведомлений...")
     while True:
         try:
-            await check_and_send_notifications()
-            await asyncio.sleep(60)
+            # Сбрасываем до проверки, чтобы не потерять вставку во время неё
+            notifications_changed.clear()
+            if await check_and_send_notifications() >= NOTIFICATION_BATCH_SIZE:
+                # Пачка заполнена — наступившие, скорее всего, ещё есть: забираем сразу
+                continue
+            delay = await get_next_notification_delay()
+            
+            # Спим до ближайшего уведомления или пока бот не добавит новые
+            try:
+                await asyncio.wait_for(notifications_changed.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
         except asyncio.CancelledError:
             logger.info("⏰ Планировщик уведомлений остановлен")
             break
         except Exception as e:
-            logger.error(f"❌ Ошибка в планировщике: {e}")
+            logger.error("❌ Ошибка в планировщике: %s", e)
             await asyncio.sleep(60)
 
 # ========== КЛАВИАТУРЫ ==========
+# Главная клавиатура одинакова для всех, собираем её один раз при импорте
+MAIN_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="➕ Проект"), KeyboardButton(text="📂 Проекты")],
+        [KeyboardButton(text="🔔 Уведомления"), KeyboardButton(text="📊 Статистика")]
+    ],
+    resize_keyboard=True,
+    one_time_keyboard=False
+)
+
 def get_main_keyboard():
     """Главная клавиатура"""
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="➕ Проект"), KeyboardButton(text="📂 Проекты")],
-            [KeyboardButton(text="🔔 Уведомления"), KeyboardButton(text="📊 Статистика")]
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=False
-    )
-    return keyboard
+    return MAIN_KEYBOARD
 
+@functools.lru_cache(maxsize=1024)
 def get_project_keyboard(project_id: int):
-    """Клавиатура проекта"""
+    """Клавиатура проекта (зависит только от project_id, поэтому кешируется)"""
     keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
             [
@@ -357,23 +839,25 @@ def get_project_keyboard(project_id: int):
     )
     return keyboard
 
+def _status_button_rows(current_status):
+    """Раскладка кнопок статусов по две в ряд: (текст, шаблон callback_data)"""
+    specs = [
+        (f"✓ {status_name}", "noop") if status_key == current_status
+        else (status_name, f"set_status:{{task_id}}:{status_key}")
+        for status_key, status_name in TASK_STATUSES.items()
+    ]
+    return [specs[i:i+2] for i in range(0, len(specs), 2)]
+
+# Статусов всего четыре, поэтому раскладку для каждого текущего статуса считаем заранее
+STATUS_BUTTON_ROWS = {status_key: _status_button_rows(status_key) for status_key in TASK_STATUSES}
+STATUS_BUTTON_ROWS_DEFAULT = _status_button_rows(None)
+
 def get_task_keyboard(task_id: int, current_status: str = 'pending'):
     """Клавиатура задачи с выбором статуса"""
-    status_buttons = []
-    
-    for status_key, status_name in TASK_STATUSES.items():
-        if status_key == current_status:
-            status_buttons.append(
-                InlineKeyboardButton(text=f"✓ {status_name}", callback_data=f"noop")
-            )
-        else:
-            status_buttons.append(
-                InlineKeyboardButton(text=status_name, callback_data=f"set_status:{task_id}:{status_key}")
-            )
-    
-    keyboard_rows = []
-    for i in range(0, len(status_buttons), 2):
-        keyboard_rows.append(status_buttons[i:i+2])
+    keyboard_rows = [
+        [InlineKeyboardButton(text=text, callback_data=data.format(task_id=task_id)) for text, data in row]
+        for row in STATUS_BUTTON_ROWS.get(current_status, STATUS_BUTTON_ROWS_DEFAULT)
+    ]
     
     keyboard_rows.append([
         InlineKeyboardButton(text="🔔 Напомнить завтра", callback_data=f"remind:{task_id}:1"),
@@ -386,8 +870,9 @@ def get_task_keyboard(task_id: int, current_status: str = 'pending'):
     
     return InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
 
+@functools.lru_cache(maxsize=1024)
 def get_tasks_keyboard(project_id: int, show_back: bool = False):
-    """Клавиатура задач проекта"""
+    """Клавиатура задач проекта (зависит только от аргументов, поэтому кешируется)"""
     keyboard_rows = [
         [InlineKeyboardButton(text="➕ Добавить задачу", callback_data=f"add_task:{project_id}")],
         [InlineKeyboardButton(text="📊 Управление задачами", callback_data=f"task_statuses:{project_id}")]
@@ -398,36 +883,33 @@ def get_tasks_keyboard(project_id: int, show_back: bool = False):
     
     return InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
 
+# Настройки уведомлений тоже статичны
+NOTIFICATION_SETTINGS_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text="За 3 дня", callback_data="notif_setting:3"),
+            InlineKeyboardButton(text="За 2 дня", callback_data="notif_setting:2"),
+            InlineKeyboardButton(text="За 1 день", callback_data="notif_setting:1")
+        ],
+        [
+            InlineKeyboardButton(text="В день дедлайна", callback_data="notif_setting:0"),
+            InlineKeyboardButton(text="Отключить все", callback_data="notif_setting:off")
+        ],
+        [InlineKeyboardButton(text="📋 Мои уведомления", callback_data="list_notifications")],
+        [InlineKeyboardButton(text="↩️ Назад", callback_data="back_to_main")]
+    ]
+)
+
 def get_notification_settings_keyboard():
     """Клавиатура настроек уведомлений"""
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="За 3 дня", callback_data="notif_setting:3"),
-                InlineKeyboardButton(text="За 2 дня", callback_data="notif_setting:2"),
-                InlineKeyboardButton(text="За 1 день", callback_data="notif_setting:1")
-            ],
-            [
-                InlineKeyboardButton(text="В день дедлайна", callback_data="notif_setting:0"),
-                InlineKeyboardButton(text="Отключить все", callback_data="notif_setting:off")
-            ],
-            [InlineKeyboardButton(text="📋 Мои уведомления", callback_data="list_notifications")],
-            [InlineKeyboardButton(text="↩️ Назад", callback_data="back_to_main")]
-        ]
-    )
-    return keyboard
+    return NOTIFICATION_SETTINGS_KEYBOARD
 
-def get_tasks_list_keyboard(tasks, project_id: int):
-    """Клавиатура со списком задач"""
+def get_tasks_list_keyboard(tasks, project_id: int, has_more: bool = False, has_prev: bool = False):
+    """Клавиатура со списком задач и переходом по страницам"""
     keyboard_rows = []
     for task in tasks:
-        deadline = task['deadline'].strftime('%d.%m.%y')
-        status_icon = {
-            'pending': '⏳',
-            'in_progress': '🔄',
-            'completed': '✅',
-            'overdue': '⚠️'
-        }.get(task['display_status'], '⏳')
+        deadline = task['deadline_str']
+        status_icon = STATUS_ICONS.get(task['display_status'], '⏳')
         
         keyboard_rows.append([
             InlineKeyboardButton(
@@ -436,18 +918,293 @@ def get_tasks_list_keyboard(tasks, project_id: int):
             )
         ])
     
+    # Курсор — (deadline, id) крайней задачи страницы; ":prev" листает назад
+    page_buttons = []
+    if has_prev:
+        first = tasks[0]
+        page_buttons.append(InlineKeyboardButton(
+            text="⬅️ Назад",
+            callback_data=f"task_statuses:{project_id}:{first['deadline'].isoformat()}:{first['id']}:prev"
+        ))
+    if has_more:
+        last = tasks[-1]
+        page_buttons.append(InlineKeyboardButton(
+            text="➡️ Далее",
+            callback_data=f"task_statuses:{project_id}:{last['deadline'].isoformat()}:{last['id']}"
+        ))
+    if page_buttons:
+        keyboard_rows.append(page_buttons)
+    
     keyboard_rows.append([
         InlineKeyboardButton(text="↩️ Назад к проекту", callback_data=f"tasks:{project_id}")
     ])
     
     return InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
 
+# ========== SQL ==========
+# Сколько задач показывать на одной странице списка статусов
+TASKS_PAGE_SIZE = 20
+
+# Тексты горячих запросов в одном месте: asyncpg кеширует подготовленные
+# выражения по тексту, так что каждый запрос планируется один раз на подключение
+
+PROJECT_NAME_SQL = "SELECT name FROM projects WHERE id = $1 AND user_id = $2"
+
+# Перенос проектов веб-версии (user_id = 1) на владельца с подсчётом его задач
+MIGRATE_WEB_DATA_SQL = '''
+    WITH moved AS (
+        UPDATE projects 
+        SET user_id = $1 
+        WHERE user_id = 1 OR user_id IS NULL
+        RETURNING id
+    )
+    SELECT
+        (SELECT COUNT(*) FROM moved) as projects_updated,
+        (SELECT COUNT(*) FROM tasks
+         WHERE project_id IN (
+             SELECT id FROM moved
+             UNION ALL
+             SELECT id FROM projects WHERE user_id = $1
+         )) as tasks_count
+'''
+
+# /test: счётчики пользователя и общая очередь уведомлений
+TEST_COUNTS_SQL = '''
+    SELECT
+        (SELECT COUNT(*) FROM projects WHERE user_id = $1) as projects,
+        (SELECT COUNT(*) FROM tasks t 
+         JOIN projects p ON t.project_id = p.id 
+         WHERE p.user_id = $1) as tasks,
+        (SELECT COUNT(*) FROM notifications WHERE is_sent = FALSE) as notifications
+'''
+
+# /id: данные пользователя и старые данные из веба (user_id = 1)
+USER_COUNTS_SQL = '''
+    SELECT
+        (SELECT COUNT(*) FROM projects WHERE user_id = $1) as projects,
+        (SELECT COUNT(*) FROM tasks t 
+         JOIN projects p ON t.project_id = p.id 
+         WHERE p.user_id = $1) as tasks,
+        (SELECT COUNT(*) FROM projects WHERE user_id = 1) as web_projects
+'''
+
+WEB_PROJECTS_COUNT_SQL = "SELECT COUNT(*) FROM projects WHERE user_id = 1"
+
+INSERT_PROJECT_SQL = "INSERT INTO projects (user_id, name) VALUES ($1, $2)"
+
+# Проверка владельца, удаление и имя для ответа — одним выражением
+DELETE_PROJECT_SQL = "DELETE FROM projects WHERE id = $1 AND user_id = $2 RETURNING name"
+
+# Проекты сразу со счётчиками задач — один запрос вместо N+1
+PROJECTS_WITH_COUNTS_SQL = '''
+    SELECT 
+        p.id, p.name,
+        COUNT(t.id) as total,
+        COUNT(t.id) FILTER (WHERE t.status = 'completed') as completed
+    FROM projects p
+    LEFT JOIN tasks t ON t.project_id = p.id
+    WHERE p.user_id = $1
+    GROUP BY p.id
+    ORDER BY p.created_at DESC
+'''
+
+TASK_STATS_SQL = '''
+    SELECT 
+        COUNT(*) as total,
+        COUNT(CASE WHEN status = 'completed' THEN 1 END) as completed,
+        COUNT(CASE WHEN status = 'in_progress' THEN 1 END) as in_progress,
+        COUNT(CASE WHEN status = 'pending' THEN 1 END) as pending,
+        COUNT(CASE WHEN status = 'overdue' THEN 1 END) as overdue
+    FROM tasks t
+    JOIN projects p ON t.project_id = p.id
+    WHERE p.user_id = $1
+'''
+
+ACTIVE_NOTIFICATIONS_COUNT_SQL = '''
+    SELECT COUNT(*) FROM notifications n
+    JOIN tasks t ON n.task_id = t.id
+    JOIN projects p ON t.project_id = p.id
+    WHERE p.user_id = $1 AND n.is_sent = FALSE
+'''
+
+DISABLE_NOTIFICATIONS_SQL = '''
+    UPDATE notifications SET is_sent = TRUE 
+    WHERE user_id = $1 AND is_sent = FALSE
+'''
+
+# Задачи проекта для просмотра: просроченные сверху
+TASKS_BY_PROJECT_SQL = '''
+    SELECT id, title, TO_CHAR(deadline, 'DD.MM.YY') as deadline_str, status as display_status
+    FROM tasks 
+    WHERE project_id = $1 
+    ORDER BY status = 'overdue' DESC, deadline ASC
+    LIMIT 20
+'''
+
+# Проверка доступа и страница задач одним запросом: нет строк — проект чужой,
+# одна строка с id = NULL — проект пуст. Страницы листаются по ключу
+# (deadline, id) после последней показанной задачи, без OFFSET
+PROJECT_TASKS_PAGE_SQL = '''
+    WITH p AS (
+        SELECT name FROM projects WHERE id = $1 AND user_id = $2
+    )
+    SELECT p.name as project_name, t.*
+    FROM p
+    LEFT JOIN LATERAL (
+        SELECT id, deadline, TO_CHAR(deadline, 'DD.MM.YY') as deadline_str, title, status as display_status
+        FROM tasks 
+        WHERE project_id = $1 
+        AND (deadline, id) > ($3::date, $4::int)
+        ORDER BY deadline ASC, id ASC
+        LIMIT $5
+    ) t ON TRUE
+'''
+
+# Предыдущая страница: задачи до курсора в обратном порядке, хендлер их разворачивает
+PROJECT_TASKS_PREV_PAGE_SQL = '''
+    WITH p AS (
+        SELECT name FROM projects WHERE id = $1 AND user_id = $2
+    )
+    SELECT p.name as project_name, t.*
+    FROM p
+    LEFT JOIN LATERAL (
+        SELECT id, deadline, TO_CHAR(deadline, 'DD.MM.YY') as deadline_str, title, status as display_status
+        FROM tasks 
+        WHERE project_id = $1 
+        AND (deadline, id) < ($3::date, $4::int)
+        ORDER BY deadline DESC, id DESC
+        LIMIT $5
+    ) t ON TRUE
+'''
+
+# То же для первой страницы, но проект определяется по задаче
+TASK_PROJECT_PAGE_SQL = '''
+    WITH p AS (
+        SELECT t.project_id, p.name as project_name
+        FROM tasks t
+        JOIN projects p ON t.project_id = p.id
+        WHERE t.id = $1 AND p.user_id = $2
+    )
+    SELECT p.project_id, p.project_name, l.*
+    FROM p
+    LEFT JOIN LATERAL (
+        SELECT id, deadline, TO_CHAR(deadline, 'DD.MM.YY') as deadline_str, title, status as display_status
+        FROM tasks 
+        WHERE project_id = p.project_id 
+        ORDER BY deadline ASC, id ASC
+        LIMIT $3
+    ) l ON TRUE
+'''
+
+# Статус берём как есть: 'overdue' поддерживают вставка задачи, смена статуса
+# и ночная проверка, так что карточка совпадает со списками задач
+TASK_DETAIL_SQL = '''
+    SELECT t.title, t.status,
+           TO_CHAR(t.deadline, 'DD.MM.YYYY') as deadline_str,
+           TO_CHAR(t.created_at, 'DD.MM.YYYY') as created_str,
+           p.name as project_name
+    FROM tasks t
+    JOIN projects p ON t.project_id = p.id
+    WHERE t.id = $1 AND p.user_id = $2
+'''
+
+# Проверка доступа, смена статуса и данные для карточки задачи одним запросом;
+# completed_at ставится только при завершении
+# Повторный клик по тому же статусу ничего не пишет: completed_at и updated_at
+# не сбрасываются, а old_status позволяет хендлеру не трогать сообщение
+SET_TASK_STATUS_SQL = '''
+    WITH cur AS (
+        SELECT t.id, t.status, t.title, t.deadline, t.created_at, p.name as project_name,
+               -- Незавершённая задача с прошедшим дедлайном остаётся просроченной:
+               -- ночная проверка её уже не увидит, а списки читают сохранённый статус
+               CASE WHEN $1::varchar <> 'completed' AND t.deadline < CURRENT_DATE
+                    THEN 'overdue' ELSE $1::varchar END as new_status
+        FROM tasks t
+        JOIN projects p ON t.project_id = p.id
+        WHERE t.id = $2 AND p.user_id = $3
+        FOR UPDATE OF t
+    ), upd AS (
+        UPDATE tasks 
+        SET status = cur.new_status, 
+            completed_at = CASE WHEN cur.new_status = 'completed' THEN NOW() END,
+            updated_at = NOW()
+        FROM cur
+        WHERE tasks.id = cur.id AND cur.status IS DISTINCT FROM cur.new_status
+    )
+    SELECT status as old_status, new_status, title, project_name,
+           TO_CHAR(deadline, 'DD.MM.YYYY') as deadline_str,
+           TO_CHAR(created_at, 'DD.MM.YYYY') as created_str
+    FROM cur
+'''
+
+# Даты форматирует и дни до дедлайна считает сам Postgres, как и для статуса 'overdue'
+LIST_NOTIFICATIONS_SQL = '''
+    SELECT TO_CHAR(n.notification_time, 'DD.MM.YYYY HH24:MI') as notification_time_str,
+           t.title, TO_CHAR(t.deadline, 'DD.MM.YYYY') as deadline_str,
+           t.deadline - CURRENT_DATE as days_left
+    FROM notifications n
+    JOIN tasks t ON n.task_id = t.id
+    JOIN projects p ON t.project_id = p.id
+    WHERE p.user_id = $1 AND n.is_sent = FALSE
+    ORDER BY n.notification_time
+    LIMIT 20
+'''
+
 # ========== ХЕНДЛЕРЫ ==========
+def spawn(coro):
+    """Запускает корутину в фоне, не дожидаясь её, и хранит ссылку до завершения"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def answer_in_background(callback: CallbackQuery, text: Optional[str] = None):
+    """Ответ на callback, запускаемый через spawn: сбой только логируем"""
+    try:
+        await callback.answer(text)
+    except Exception as e:
+        logger.warning("⚠️ Не удалось ответить на callback: %s", e)
+
+# Хеш последнего показанного содержимого по (chat_id, message_id): повторное нажатие
+# «Назад» на уже актуальном экране не шлёт edit, который Telegram всё равно отклонит
+# с "message is not modified"
+LAST_SHOWN_MAX_SIZE = 4096
+last_shown = OrderedDict()
+
+async def edit_and_answer(callback: CallbackQuery, text: str, answer_text: Optional[str] = None, **kwargs):
+    """Правит сообщение и отвечает на callback параллельно, а не двумя запросами подряд"""
+    message = callback.message
+    key = (message.chat.id, message.message_id)
+    content_hash = hash((text, repr(kwargs.get('reply_markup'))))
+    if last_shown.get(key) == content_hash:
+        last_shown.move_to_end(key)
+        await callback.answer(answer_text)
+        return
+    
+    # Методы aiogram не хешируются, поэтому в gather передаём корутины bot(...).
+    # Изменения в БД к этому моменту уже закоммичены: сбой одного запроса к Telegram
+    # только логируем, повторный answer хендлера всё равно был бы отклонён
+    edited, answered = await asyncio.gather(
+        bot(message.edit_text(text, **kwargs)),
+        bot(callback.answer(answer_text)),
+        return_exceptions=True
+    )
+    if isinstance(answered, Exception):
+        logger.error("❌ Ошибка ответа на callback: %s", answered)
+    if isinstance(edited, Exception):
+        logger.error("❌ Ошибка редактирования сообщения: %s", edited)
+        return
+    
+    last_shown[key] = content_hash
+    last_shown.move_to_end(key)
+    if len(last_shown) > LAST_SHOWN_MAX_SIZE:
+        last_shown.popitem(last=False)
+
 @dp.message(CommandStart())
 async def cmd_start(message: Message):
     """Команда /start"""
     user_id = message.from_user.id
-    logger.info(f"👉 /start от {user_id}")
+    logger.debug("👉 /start от %s", user_id)
     
     # Автоматически мигрируем данные если нужно
     if user_id == TELEGRAM_USER_ID:
@@ -464,13 +1221,11 @@ async def cmd_start(message: Message):
         reply_markup=get_main_keyboard()
     )
 
-@dp.message(Command("help"))
-async def cmd_help(message: Message):
-    """Команда /help"""
-    help_text = """
-📚 **Помощь по командам:**
+# Справка не зависит от пользователя
+HELP_TEXT = """
+📚 <b>Помощь по командам:</b>
 
-**Основные команды:**
+<b>Основные команды:</b>
 /start - Начало работы (автоматическая миграция)
 /ping - Проверка связи
 /id - Ваш ID
@@ -478,32 +1233,36 @@ async def cmd_help(message: Message):
 /help - Эта справка
 /migrate - Принудительная миграция данных
 
-**Функционал:**
+<b>Функционал:</b>
 • Создание проектов и задач
 • Управление статусами задач
 • Уведомления о дедлайнах
 • Статистика по задачам
 • Синхронизация с веб-версией
 
-**Статусы задач:**
+<b>Статусы задач:</b>
 ⏳ В ожидании - задача не начата
 🔄 В работе - задача выполняется
 ✅ Завершена - задача выполнена
 ⚠️ Просрочена - дедлайн прошел
 
-**Уведомления:**
+<b>Уведомления:</b>
 Бот напомнит о дедлайнах за 3, 2, 1 день и в день выполнения.
 
-**Синхронизация:**
+<b>Синхронизация:</b>
 Все проекты и задачи синхронизируются между ботом и веб-версией.
-    """
-    await message.answer(help_text, parse_mode=ParseMode.MARKDOWN)
+"""
+
+@dp.message(Command("help"))
+async def cmd_help(message: Message):
+    """Команда /help"""
+    await message.answer(HELP_TEXT)
 
 @dp.message(Command("migrate"))
 async def cmd_migrate(message: Message):
     """Принудительная миграция данных из веб-версии"""
     user_id = message.from_user.id
-    logger.info(f"🔄 Принудительная миграция от {user_id}")
+    logger.info("🔄 Принудительная миграция от %s", user_id)
     
     if user_id != TELEGRAM_USER_ID:
         await message.answer("❌ Эта команда доступна только владельцу бота.")
@@ -524,200 +1283,136 @@ async def cmd_migrate(message: Message):
             else:
                 await message.answer("ℹ️ Нет данных для миграции. Возможно, данные уже синхронизированы.")
         else:
-            await message.answer(f"❌ Ошибка при миграции: {result['error']}")
+            await message.answer(f"❌ Ошибка при миграции: {html.escape(result['error'], quote=False)}")
     except Exception as e:
-        logger.error(f"❌ Ошибка миграции: {e}")
-        await message.answer(f"❌ Ошибка: {str(e)}")
+        logger.error("❌ Ошибка миграции: %s", e)
+        await message.answer(f"❌ Ошибка: {html.escape(str(e), quote=False)}")
 
 @dp.message(Command("ping"))
 async def cmd_ping(message: Message):
-    logger.info(f"🏓 /ping от {message.from_user.id}")
+    logger.debug("🏓 /ping от %s", message.from_user.id)
     await message.answer("🏓 Pong! Бот жив и работает")
 
 @dp.message(Command("test"))
 async def cmd_test(message: Message):
-    logger.info(f"🧪 /test от {message.from_user.id}")
+    logger.debug("🧪 /test от %s", message.from_user.id)
     try:
         pool = await get_db_pool()
         async with pool.acquire() as conn:
-            projects_count = await conn.fetchval('SELECT COUNT(*) FROM projects WHERE user_id = $1', message.from_user.id)
-            tasks_count = await conn.fetchval('''
-                SELECT COUNT(*) FROM tasks t 
-                JOIN projects p ON t.project_id = p.id 
-                WHERE p.user_id = $1
-            ''', message.from_user.id)
-            notifications_count = await conn.fetchval("SELECT COUNT(*) FROM notifications WHERE is_sent = FALSE")
-            
-            await message.answer(
-                f"✅ Бот работает!\n"
-                f"📁 Ваших проектов: {projects_count}\n"
-                f"📋 Ваших задач: {tasks_count}\n"
-                f"🔔 Активных уведомлений: {notifications_count}"
-            )
+            counts = await conn.fetchrow(TEST_COUNTS_SQL, message.from_user.id)
+        
+        await message.answer(
+            f"✅ Бот работает!\n"
+            f"📁 Ваших проектов: {counts['projects']}\n"
+            f"📋 Ваших задач: {counts['tasks']}\n"
+            f"🔔 Активных уведомлений: {counts['notifications']}"
+        )
     except Exception as e:
-        await message.answer(f"❌ Ошибка: {str(e)[:100]}")
+        await message.answer(f"❌ Ошибка: {html.escape(str(e)[:100], quote=False)}")
 
 @dp.message(Command("id"))
 async def cmd_id(message: Message):
     """Показать ID пользователя"""
     user_id = message.from_user.id
-    logger.info(f"🆔 /id от {user_id}")
+    logger.debug("🆔 /id от %s", user_id)
     
     info_text = f"""
-🆔 **Ваш Telegram ID:** `{user_id}`
+🆔 <b>Ваш Telegram ID:</b> <code>{user_id}</code>
 
-**Синхронизация с веб-версией:**
-• Веб-версия настроена на использование ID: `{TELEGRAM_USER_ID}`
-• Для синхронизации используйте команду `/migrate`
+<b>Синхронизация с веб-версией:</b>
+• Веб-версия настроена на использование ID: <code>{TELEGRAM_USER_ID}</code>
+• Для синхронизации используйте команду <code>/migrate</code>
 • Все данные автоматически синхронизируются между ботом и вебом
 
-**Текущий статус:**
+<b>Текущий статус:</b>
 """
     
     try:
         pool = await get_db_pool()
         async with pool.acquire() as conn:
-            # Проверяем данные для этого пользователя
-            user_projects = await conn.fetchval('SELECT COUNT(*) FROM projects WHERE user_id = $1', user_id)
-            user_tasks = await conn.fetchval('''
-                SELECT COUNT(*) FROM tasks t 
-                JOIN projects p ON t.project_id = p.id 
-                WHERE p.user_id = $1
-            ''', user_id)
-            
-            info_text += f"• Ваших проектов: {user_projects}\n"
-            info_text += f"• Ваших задач: {user_tasks}\n"
-            
-            # Проверяем данные с user_id = 1 (старые данные из веба)
-            web_projects = await conn.fetchval('SELECT COUNT(*) FROM projects WHERE user_id = 1')
-            if web_projects > 0:
-                info_text += f"\n⚠️ **Обнаружены данные из веб-версии:** {web_projects} проектов\n"
-                info_text += f"Используйте команду `/migrate` чтобы перенести их в ваш аккаунт."
+            # Данные пользователя и старые данные из веба (user_id = 1) одним запросом
+            counts = await conn.fetchrow(USER_COUNTS_SQL, user_id)
+        
+        info_text += f"• Ваших проектов: {counts['projects']}\n"
+        info_text += f"• Ваших задач: {counts['tasks']}\n"
+        
+        if counts['web_projects'] > 0:
+            info_text += f"\n⚠️ <b>Обнаружены данные из веб-версии:</b> {counts['web_projects']} проектов\n"
+            info_text += f"Используйте команду <code>/migrate</code> чтобы перенести их в ваш аккаунт."
     
     except Exception as e:
-        logger.error(f"❌ Ошибка получения информации: {e}")
+        logger.error("❌ Ошибка получения информации: %s", e)
     
-    await message.answer(info_text, parse_mode=ParseMode.MARKDOWN)
+    await message.answer(info_text)
 
-@dp.message(F.text == "🔔 Уведомления")
-async def notifications_menu(message: Message):
+async def notifications_menu(message: Message, state: FSMContext):
     """Меню уведомлений"""
     await message.answer(
-        "🔔 **Настройка уведомлений**\n\n"
+        "🔔 <b>Настройка уведомлений</b>\n\n"
         "Выберите, за сколько дней до дедлайна получать уведомления:",
-        reply_markup=get_notification_settings_keyboard(),
-        parse_mode=ParseMode.MARKDOWN
+        reply_markup=get_notification_settings_keyboard()
     )
 
-@dp.message(F.text == "📊 Статистика")
-async def statistics_menu(message: Message):
+async def statistics_menu(message: Message, state: FSMContext):
     """Статистика по задачам"""
     try:
         pool = await get_db_pool()
         async with pool.acquire() as conn:
             # Статистика по статусам
-            stats = await conn.fetch('''
-                SELECT 
-                    COUNT(*) as total,
-                    COUNT(CASE WHEN status = 'completed' THEN 1 END) as completed,
-                    COUNT(CASE WHEN status = 'in_progress' THEN 1 END) as in_progress,
-                    COUNT(CASE WHEN status = 'pending' THEN 1 END) as pending,
-                    COUNT(CASE WHEN status = 'overdue' THEN 1 END) as overdue
-                FROM tasks t
-                JOIN projects p ON t.project_id = p.id
-                WHERE p.user_id = $1
-            ''', message.from_user.id)
+            stats = await conn.fetch(TASK_STATS_SQL, message.from_user.id)
             
             # Активные уведомления
-            active_notifications = await conn.fetchval('''
-                SELECT COUNT(*) FROM notifications n
-                JOIN tasks t ON n.task_id = t.id
-                JOIN projects p ON t.project_id = p.id
-                WHERE p.user_id = $1 AND n.is_sent = FALSE
-            ''', message.from_user.id)
+            active_notifications = await conn.fetchval(ACTIVE_NOTIFICATIONS_COUNT_SQL, message.from_user.id)
             
             if stats and len(stats) > 0 and stats[0]['total'] > 0:
                 stat = stats[0]
                 efficiency = round((stat['completed'] / stat['total']) * 100, 1) if stat['total'] > 0 else 0
                 message_text = (
-                    f"📊 **Ваша статистика:**\n\n"
+                    f"📊 <b>Ваша статистика:</b>\n\n"
                     f"• Всего задач: {stat['total']}\n"
                     f"• ✅ Завершено: {stat['completed']}\n"
                     f"• 🔄 В работе: {stat['in_progress']}\n"
                     f"• ⏳ В ожидании: {stat['pending']}\n"
                     f"• ⚠️ Просрочено: {stat['overdue']}\n"
                     f"• 🔔 Активных уведомлений: {active_notifications}\n\n"
-                    f"**Эффективность:** {efficiency}%"
+                    f"<b>Эффективность:</b> {efficiency}%"
                 )
             else:
                 message_text = "📊 У вас пока нет задач для статистики."
             
-            await message.answer(message_text, parse_mode=ParseMode.MARKDOWN)
+            await message.answer(message_text)
             
     except Exception as e:
-        logger.error(f"❌ Ошибка получения статистики: {e}")
+        logger.error("❌ Ошибка получения статистики: %s", e)
         await message.answer("❌ Ошибка при получении статистики.")
 
 # Создание проекта
-@dp.message(F.text == "➕ Проект")
 async def start_create_project(message: Message, state: FSMContext):
-    logger.info(f"📝 Создание проекта от {message.from_user.id}")
+    logger.debug("📝 Создание проекта от %s", message.from_user.id)
     await message.answer("Введите название проекта:")
     await state.set_state(ProjectState.waiting_for_name)
 
-@dp.message(ProjectState.waiting_for_name)
-async def process_project_name(message: Message, state: FSMContext):
-    project_name = message.text.strip()
-    
-    if not project_name:
-        await message.answer("Название проекта не может быть пустым. Попробуйте еще раз:")
-        return
-    
-    try:
-        pool = await get_db_pool()
-        async with pool.acquire() as conn:
-            await conn.execute(
-                "INSERT INTO projects (user_id, name) VALUES ($1, $2)",
-                message.from_user.id, project_name
-            )
-        
-        await message.answer(f"✅ Проект '{project_name}' создан!", reply_markup=get_main_keyboard())
-        logger.info(f"✅ Проект создан: {project_name}")
-        
-    except Exception as e:
-        logger.error(f"❌ Ошибка при создании проекта: {e}")
-        await message.answer("❌ Произошла ошибка при создании проекта.")
-    
-    await state.clear()
-
 # Просмотр проектов
-@dp.message(F.text == "📂 Проекты")
-async def show_projects(message: Message):
+async def show_projects(message: Message, state: FSMContext):
     user_id = message.from_user.id
-    logger.info(f"📁 Просмотр проектов от {user_id}")
-    
-    # Если это владелец, проверяем миграцию
-    if user_id == TELEGRAM_USER_ID:
-        try:
-            pool = await get_db_pool()
-            async with pool.acquire() as conn:
-                # Проверяем есть ли данные с user_id = 1
-                web_data_count = await conn.fetchval('SELECT COUNT(*) FROM projects WHERE user_id = 1')
-                if web_data_count > 0:
-                    await message.answer(
-                        f"⚠️ Обнаружено {web_data_count} проектов из веб-версии.\n"
-                        f"Используйте команду `/migrate` чтобы перенести их в ваш аккаунт."
-                    )
-        except Exception as e:
-            logger.error(f"❌ Ошибка проверки веб-данных: {e}")
+    logger.debug("📁 Просмотр проектов от %s", user_id)
     
     try:
         pool = await get_db_pool()
         
+        # Одно подключение на весь хендлер
         async with pool.acquire() as conn:
-            projects = await conn.fetch(
-                "SELECT id, name FROM projects WHERE user_id = $1 ORDER BY created_at DESC",
-                user_id
+            # Если это владелец, проверяем есть ли данные с user_id = 1
+            web_data_count = 0
+            if user_id == TELEGRAM_USER_ID:
+                web_data_count = await conn.fetchval(WEB_PROJECTS_COUNT_SQL)
+            
+            projects = await conn.fetch(PROJECTS_WITH_COUNTS_SQL, user_id)
+        
+        if web_data_count > 0:
+            await message.answer(
+                f"⚠️ Обнаружено {web_data_count} проектов из веб-версии.\n"
+                f"Используйте команду <code>/migrate</code> чтобы перенести их в ваш аккаунт."
             )
         
         if not projects:
@@ -727,493 +1422,485 @@ async def show_projects(message: Message):
             )
             return
         
+        # Отправляем по очереди, чтобы порядок проектов в чате совпадал с выборкой
         for project in projects:
-            async with pool.acquire() as conn:
-                tasks_stats = await conn.fetchrow('''
-                    SELECT 
-                        COUNT(*) as total,
-                        COUNT(CASE WHEN status = 'completed' THEN 1 END) as completed
-                    FROM tasks 
-                    WHERE project_id = $1
-                ''', project['id'])
-                
-                stats_text = ""
-                if tasks_stats and tasks_stats['total'] > 0:
-                    stats_text = f" ({tasks_stats['completed']}/{tasks_stats['total']} завершено)"
-                
-                await message.answer(
-                    f"📁 {project['name']}{stats_text}",
-                    reply_markup=get_project_keyboard(project['id'])
-                )
+            stats_text = ""
+            if project['total'] > 0:
+                stats_text = f" ({project['completed']}/{project['total']} завершено)"
+            
+            await message.answer(
+                f"📁 {html.escape(project['name'], quote=False)}{stats_text}",
+                reply_markup=get_project_keyboard(project['id'])
+            )
                 
     except Exception as e:
-        logger.error(f"❌ Ошибка при получении проектов: {e}")
+        logger.error("❌ Ошибка при получении проектов: %s", e)
         await message.answer("❌ Произошла ошибка при получении проектов.")
 
+# Кнопки главного меню: одна проверка по словарю вместо цепочки фильтров F.text
+MENU_ROUTES = {
+    "➕ Проект": start_create_project,
+    "📂 Проекты": show_projects,
+    "🔔 Уведомления": notifications_menu,
+    "📊 Статистика": statistics_menu,
+}
+
+@dp.message(F.text.in_(MENU_ROUTES))
+async def menu_button(message: Message, state: FSMContext):
+    """Диспетчер кнопок главного меню"""
+    await MENU_ROUTES[message.text](message, state)
+
+@dp.message(ProjectState.waiting_for_name)
+async def process_project_name(message: Message, state: FSMContext):
+    project_name = message.text.strip()
+    
+    if not project_name:
+        await message.answer("Название проекта не может быть пустым. Попробуйте еще раз:")
+        return
+    
+    try:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(INSERT_PROJECT_SQL, message.from_user.id, project_name)
+        
+        # Подтверждаем только после коммита: проект сразу виден в «📂 Проекты»
+        await message.answer(f"✅ Проект '{html.escape(project_name, quote=False)}' создан!", reply_markup=get_main_keyboard())
+        logger.info("✅ Проект создан: %s", project_name)
+        
+    except Exception as e:
+        logger.error("❌ Ошибка при создании проекта: %s", e)
+        await message.answer("❌ Произошла ошибка при создании проекта.")
+    
+    await state.clear()
+
 # Callback для кнопок проекта
-@dp.callback_query(F.data.startswith("tasks:"))
-async def show_tasks(callback: CallbackQuery):
-    project_id = int(callback.data.split(":")[1])
+async def show_tasks(callback: CallbackQuery, payload: str, state: FSMContext):
+    project_id = int(payload)
     user_id = callback.from_user.id
-    logger.info(f"📋 Задачи проекта {project_id} от {user_id}")
+    logger.debug("📋 Задачи проекта %s от %s", project_id, user_id)
     
     try:
         pool = await get_db_pool()
         async with pool.acquire() as conn:
-            project = await conn.fetchrow(
-                "SELECT name FROM projects WHERE id = $1 AND user_id = $2",
-                project_id, user_id
-            )
+            project_name = await get_project_name(conn, project_id, user_id)
             
-            if not project:
+            if project_name is None:
                 await callback.answer("Проект не найден!")
                 return
             
-            # Получаем задачи с учетом просроченных
-            tasks = await conn.fetch('''
-                SELECT id, title, deadline, status,
-                    CASE 
-                        WHEN deadline < CURRENT_DATE AND status != 'completed' THEN 'overdue'
-                        ELSE status
-                    END as display_status
-                FROM tasks 
-                WHERE project_id = $1 
-                ORDER BY 
-                    CASE WHEN deadline < CURRENT_DATE AND status != 'completed' THEN 0 ELSE 1 END,
-                    deadline ASC
-                LIMIT 20
-            ''', project_id)
+            # Просроченные задачи планировщик уже перевёл в status = 'overdue'
+            tasks = await conn.fetch(TASKS_BY_PROJECT_SQL, project_id)
         
         if not tasks:
-            message_text = f"📁 **Проект: {project['name']}**\n\nЗадач пока нет."
+            message_text = f"📁 <b>Проект: {project_name}</b>\n\nЗадач пока нет."
         else:
-            message_text = f"📁 **Проект: {project['name']}**\n\n📋 **Задачи:**\n"
+            parts = [f"📁 <b>Проект: {project_name}</b>\n\n📋 <b>Задачи:</b>\n"]
             for task in tasks:
-                deadline = task['deadline'].strftime('%d.%m.%y')
-                status_icon = {
-                    'pending': '⏳',
-                    'in_progress': '🔄',
-                    'completed': '✅',
-                    'overdue': '⚠️'
-                }.get(task['display_status'], '⏳')
-                
-                message_text += f"{status_icon} {task['title']} — {deadline}\n"
+                status_icon = STATUS_ICONS.get(task['display_status'], '⏳')
+                parts.append(f"{status_icon} {html.escape(task['title'], quote=False)} — {task['deadline_str']}\n")
+            message_text = "".join(parts)
         
-        await callback.message.edit_text(
+        await edit_and_answer(
+            callback,
             message_text,
-            reply_markup=get_tasks_keyboard(project_id, show_back=True),
-            parse_mode=ParseMode.MARKDOWN
+            reply_markup=get_tasks_keyboard(project_id, show_back=True)
         )
-        await callback.answer()
         
     except Exception as e:
-        logger.error(f"❌ Ошибка при получении задач: {e}")
+        logger.error("❌ Ошибка при получении задач: %s", e)
         await callback.answer("❌ Произошла ошибка.")
 
-@dp.callback_query(F.data.startswith("task_statuses:"))
-async def show_task_statuses(callback: CallbackQuery):
+async def show_task_statuses(callback: CallbackQuery, payload: str, state: FSMContext):
     """Показать задачи с возможностью изменения статуса"""
-    project_id = int(callback.data.split(":")[1])
+    # task_statuses:<project_id>[:<deadline>:<task_id>[:prev]] — курсор страницы:
+    # без суффикса задачи после него, с ":prev" — перед ним
+    parts = payload.split(":")
+    project_id = int(parts[0])
     user_id = callback.from_user.id
     
     try:
+        if len(parts) < 3:
+            cursor_deadline, cursor_id = date.min, 0
+        else:
+            cursor_deadline, cursor_id = date.fromisoformat(parts[1]), int(parts[2])
+        backwards = len(parts) > 3 and parts[3] == "prev"
+        
         pool = await get_db_pool()
         async with pool.acquire() as conn:
-            project = await conn.fetchrow(
-                "SELECT name FROM projects WHERE id = $1 AND user_id = $2",
-                project_id, user_id
+            # Берём на одну задачу больше, чтобы понять, есть ли ещё страница в ту же сторону
+            rows = await conn.fetch(
+                PROJECT_TASKS_PREV_PAGE_SQL if backwards else PROJECT_TASKS_PAGE_SQL,
+                project_id, user_id, cursor_deadline, cursor_id, TASKS_PAGE_SIZE + 1
             )
-            
-            if not project:
-                await callback.answer("Проект не найден!")
-                return
-            
-            tasks = await conn.fetch('''
-                SELECT id, title, deadline, status,
-                    CASE 
-                        WHEN deadline < CURRENT_DATE AND status != 'completed' THEN 'overdue'
-                        ELSE status
-                    END as display_status
-                FROM tasks 
-                WHERE project_id = $1 
-                ORDER BY deadline ASC
-                LIMIT 20
-            ''', project_id)
+        
+        if not rows:
+            await callback.answer("Проект не найден!")
+            return
+        
+        project_name = html.escape(rows[0]['project_name'], quote=False)
+        tasks = [row for row in rows if row['id'] is not None]
+        more_in_direction = len(tasks) > TASKS_PAGE_SIZE
+        tasks = tasks[:TASKS_PAGE_SIZE]
+        if backwards:
+            tasks.reverse()
+            has_prev, has_more = more_in_direction, True
+        else:
+            has_prev, has_more = len(parts) >= 3, more_in_direction
         
         if not tasks:
-            await callback.message.edit_text(
-                f"📁 **Проект: {project['name']}**\n\nВ этом проекте пока нет задач.",
-                reply_markup=get_tasks_keyboard(project_id, show_back=True),
-                parse_mode=ParseMode.MARKDOWN
+            await edit_and_answer(
+                callback,
+                f"📁 <b>Проект: {project_name}</b>\n\nВ этом проекте пока нет задач.",
+                answer_text="В этом проекте пока нет задач!",
+                reply_markup=get_tasks_keyboard(project_id, show_back=True)
             )
-            await callback.answer("В этом проекте пока нет задач!")
             return
         
-        message_text = f"📁 **Проект: {project['name']}**\n\n📋 **Задачи (кликните для изменения статуса):**\n"
+        message_text = f"📁 <b>Проект: {project_name}</b>\n\n📋 <b>Задачи (кликните для изменения статуса):</b>\n"
         
-        await callback.message.edit_text(
+        await edit_and_answer(
+            callback,
             message_text,
-            reply_markup=get_tasks_list_keyboard(tasks, project_id),
-            parse_mode=ParseMode.MARKDOWN
+            reply_markup=get_tasks_list_keyboard(tasks, project_id, has_more, has_prev)
         )
-        await callback.answer()
         
     except Exception as e:
-        logger.error(f"❌ Ошибка при получении статусов задач: {e}")
+        logger.error("❌ Ошибка при получении статусов задач: %s", e)
         await callback.answer("❌ Произошла ошибка.")
 
-@dp.callback_query(F.data.startswith("task_detail:"))
-async def show_task_detail(callback: CallbackQuery):
+async def show_task_detail(callback: CallbackQuery, payload: str, state: FSMContext):
     """Детальная информация о задаче с выбором статуса"""
-    task_id = int(callback.data.split(":")[1])
+    task_id = int(payload)
     user_id = callback.from_user.id
     
     try:
         pool = await get_db_pool()
         async with pool.acquire() as conn:
-            task = await conn.fetchrow('''
-                SELECT t.*, p.name as project_name, p.id as project_id
-                FROM tasks t
-                JOIN projects p ON t.project_id = p.id
-                WHERE t.id = $1 AND p.user_id = $2
-            ''', task_id, user_id)
+            task = await conn.fetchrow(TASK_DETAIL_SQL, task_id, user_id)
             
             if not task:
                 await callback.answer("Задача не найдена!")
                 return
             
-            deadline = task['deadline'].strftime('%d.%m.%Y')
-            created = task['created_at'].strftime('%d.%m.%Y')
-            status_text = TASK_STATUSES.get(task['status'], '⏳ В ожидании')
-            
-            # Проверяем, просрочена ли задача
             current_status = task['status']
-            if task['deadline'] < datetime.now().date() and current_status != 'completed':
-                current_status = 'overdue'
-                status_text = TASK_STATUSES.get('overdue')
+            status_text = TASK_STATUSES.get(current_status, '⏳ В ожидании')
             
             message_text = (
-                f"📋 **Задача:** {task['title']}\n"
-                f"📁 **Проект:** {task['project_name']}\n"
-                f"📅 **Создана:** {created}\n"
-                f"⏰ **Дедлайн:** {deadline}\n"
-                f"📊 **Статус:** {status_text}\n\n"
+                f"📋 <b>Задача:</b> {html.escape(task['title'], quote=False)}\n"
+                f"📁 <b>Проект:</b> {html.escape(task['project_name'], quote=False)}\n"
+                f"📅 <b>Создана:</b> {task['created_str']}\n"
+                f"⏰ <b>Дедлайн:</b> {task['deadline_str']}\n"
+                f"📊 <b>Статус:</b> {status_text}\n\n"
                 f"Выберите новый статус:"
             )
-            
-            await callback.message.edit_text(
-                message_text,
-                reply_markup=get_task_keyboard(task_id, current_status),
-                parse_mode=ParseMode.MARKDOWN
-            )
-        await callback.answer()
+        
+        await edit_and_answer(
+            callback,
+            message_text,
+            reply_markup=get_task_keyboard(task_id, current_status)
+        )
         
     except Exception as e:
-        logger.error(f"❌ Ошибка при получении деталей задачи: {e}")
+        logger.error("❌ Ошибка при получении деталей задачи: %s", e)
         await callback.answer("❌ Произошла ошибка.")
 
-@dp.callback_query(F.data.startswith("set_status:"))
-async def set_task_status(callback: CallbackQuery):
+async def set_task_status(callback: CallbackQuery, payload: str, state: FSMContext):
     """Изменение статуса задачи"""
-    _, task_id, new_status = callback.data.split(":")
+    task_id, new_status = payload.split(":")
     task_id = int(task_id)
     user_id = callback.from_user.id
     
     try:
         pool = await get_db_pool()
         async with pool.acquire() as conn:
-            # Проверяем доступ к задаче
-            task = await conn.fetchrow('''
-                SELECT t.*, p.id as project_id FROM tasks t
-                JOIN projects p ON t.project_id = p.id
-                WHERE t.id = $1 AND p.user_id = $2
-            ''', task_id, user_id)
-            
-            if not task:
-                await callback.answer("Задача не найдена!")
-                return
-            
-            # Обновляем статус
-            if new_status == 'completed':
-                await conn.execute('''
-                    UPDATE tasks 
-                    SET status = $1, 
-                        completed_at = NOW(),
-                        updated_at = NOW()
-                    WHERE id = $2
-                ''', new_status, task_id)
+            # Обновляем статус; None — задачи нет или она чужая
+            task = await conn.fetchrow(SET_TASK_STATUS_SQL, new_status, task_id, user_id)
+        
+        if not task:
+            await callback.answer("Задача не найдена!")
+            return
+        
+        # Запрошенный статус мог замениться на 'overdue' (дедлайн прошёл)
+        requested_status, new_status = new_status, task['new_status']
+        
+        # Двойной клик или старое сообщение: статус уже такой, текст не меняется
+        if task['old_status'] == new_status:
+            if requested_status != new_status:
+                await callback.answer("⚠️ Дедлайн прошёл: задача остаётся просроченной")
             else:
-                await conn.execute('''
-                    UPDATE tasks 
-                    SET status = $1, 
-                        completed_at = NULL,
-                        updated_at = NOW()
-                    WHERE id = $2
-                ''', new_status, task_id)
-            
-            status_text = TASK_STATUSES.get(new_status, 'Неизвестный статус')
-            await callback.answer(f"✅ Статус изменен на: {status_text}")
-            
-            # Обновляем сообщение
-            deadline = task['deadline'].strftime('%d.%m.%Y')
-            created = task['created_at'].strftime('%d.%m.%Y')
-            
-            message_text = (
-                f"📋 **Задача:** {task['title']}\n"
-                f"📁 **Проект:** {task['project_name'] if 'project_name' in task else '...'}\n"
-                f"📅 **Создана:** {created}\n"
-                f"⏰ **Дедлайн:** {deadline}\n"
-                f"📊 **Статус:** {status_text}\n\n"
-                f"Выберите новый статус:"
-            )
-            
-            await callback.message.edit_text(
-                message_text,
-                reply_markup=get_task_keyboard(task_id, new_status),
-                parse_mode=ParseMode.MARKDOWN
-            )
+                await callback.answer("Без изменений")
+            return
+        
+        status_text = TASK_STATUSES.get(new_status, 'Неизвестный статус')
+        
+        # Обновляем сообщение
+        message_text = (
+            f"📋 <b>Задача:</b> {html.escape(task['title'], quote=False)}\n"
+            f"📁 <b>Проект:</b> {html.escape(task['project_name'], quote=False)}\n"
+            f"📅 <b>Создана:</b> {task['created_str']}\n"
+            f"⏰ <b>Дедлайн:</b> {task['deadline_str']}\n"
+            f"📊 <b>Статус:</b> {status_text}\n\n"
+            f"Выберите новый статус:"
+        )
+        
+        await edit_and_answer(
+            callback,
+            message_text,
+            answer_text=(
+                f"✅ Статус изменен на: {status_text}" if requested_status == new_status
+                else f"⚠️ Дедлайн прошёл, статус: {status_text}"
+            ),
+            reply_markup=get_task_keyboard(task_id, new_status)
+        )
             
     except Exception as e:
-        logger.error(f"❌ Ошибка при изменении статуса: {e}")
+        logger.error("❌ Ошибка при изменении статуса: %s", e)
         await callback.answer("❌ Ошибка при изменении статуса")
 
-@dp.callback_query(F.data.startswith("remind:"))
-async def set_reminder(callback: CallbackQuery):
+# Кнопки напоминаний (get_task_keyboard): за сколько дней -> (тип уведомления, ответ)
+REMINDERS = MappingProxyType({
+    0: ("deadline_today", "✅ Напоминание установлено на сегодня!"),
+    1: ("reminder_1_days", "✅ Напоминание установлено за 1 день!"),
+})
+
+async def set_reminder(callback: CallbackQuery, payload: str, state: FSMContext):
     """Установка напоминания"""
-    _, task_id, days_before = callback.data.split(":")
+    task_id, days_before = payload.split(":")
     task_id = int(task_id)
     days_before = int(days_before)
     user_id = callback.from_user.id
     
     try:
         pool = await get_db_pool()
+        notification_type, answer_text = REMINDERS.get(days_before) or (
+            f"reminder_{days_before}_days", f"✅ Напоминание установлено за {days_before} дня!"
+        )
         async with pool.acquire() as conn:
-            # Проверяем доступ к задаче
-            task = await conn.fetchrow('''
-                SELECT t.* FROM tasks t
-                JOIN projects p ON t.project_id = p.id
-                WHERE t.id = $1 AND p.user_id = $2
-            ''', task_id, user_id)
-            
-            if not task:
-                await callback.answer("Задача не найдена!")
-                return
-            
-            # Создаем уведомление
-            notification_type = f"reminder_{days_before}_days" if days_before > 0 else "deadline_today"
-            await create_notification(user_id, task_id, notification_type, days_before)
-            
-            if days_before == 0:
-                await callback.answer("✅ Напоминание установлено на сегодня!")
-            else:
-                await callback.answer(f"✅ Напоминание установлено за {days_before} дня!")
+            # Доступ к задаче проверяется тем же запросом; напоминание «на сегодня»
+            # после 9:00 должно прийти сразу, поэтому прошедшее время не отсекаем
+            created = await create_notifications(
+                conn, user_id, task_id, ((notification_type, days_before),), skip_past=False
+            )
+        
+        if created:
+            notifications_changed.set()
+        
+        if created is None:
+            await callback.answer("Задача не найдена!")
+        else:
+            await callback.answer(answer_text)
             
     except Exception as e:
-        logger.error(f"❌ Ошибка при установке напоминания: {e}")
+        logger.error("❌ Ошибка при установке напоминания: %s", e)
         await callback.answer("❌ Ошибка при установке напоминания")
 
-@dp.callback_query(F.data.startswith("back_to_task_list:"))
-async def back_to_task_list(callback: CallbackQuery):
+async def back_to_task_list(callback: CallbackQuery, payload: str, state: FSMContext):
     """Возврат к списку задач"""
     user_id = callback.from_user.id
     
     try:
-        task_id = int(callback.data.split(":")[1])
+        task_id = int(payload)
         
         pool = await get_db_pool()
         async with pool.acquire() as conn:
-            # Получаем информацию о задаче
-            task_info = await conn.fetchrow('''
-                SELECT t.project_id, p.name as project_name
-                FROM tasks t
-                JOIN projects p ON t.project_id = p.id
-                WHERE t.id = $1 AND p.user_id = $2
-            ''', task_id, user_id)
-            
-            if not task_info:
-                await callback.answer("Задача не найдена!")
-                return
-            
-            project_id = task_info['project_id']
-            
-            # Получаем задачи проекта
-            tasks = await conn.fetch('''
-                SELECT id, title, deadline, status,
-                    CASE 
-                        WHEN deadline < CURRENT_DATE AND status != 'completed' THEN 'overdue'
-                        ELSE status
-                    END as display_status
-                FROM tasks 
-                WHERE project_id = $1 
-                ORDER BY deadline ASC
-                LIMIT 20
-            ''', project_id)
+            rows = await conn.fetch(TASK_PROJECT_PAGE_SQL, task_id, user_id, TASKS_PAGE_SIZE + 1)
+        
+        if not rows:
+            await callback.answer("Задача не найдена!")
+            return
+        
+        task_info = rows[0]
+        project_id = task_info['project_id']
+        tasks = [row for row in rows if row['id'] is not None]
+        has_more = len(tasks) > TASKS_PAGE_SIZE
+        tasks = tasks[:TASKS_PAGE_SIZE]
         
         if not tasks:
-            message_text = f"📁 **Проект: {task_info['project_name']}**\n\nВ этом проекте пока нет задач."
+            message_text = f"📁 <b>Проект: {html.escape(task_info['project_name'], quote=False)}</b>\n\nВ этом проекте пока нет задач."
             keyboard = get_tasks_keyboard(project_id, show_back=True)
         else:
-            message_text = f"📁 **Проект: {task_info['project_name']}**\n\n📋 **Задачи (кликните для изменения статуса):**\n"
-            keyboard = get_tasks_list_keyboard(tasks, project_id)
+            message_text = f"📁 <b>Проект: {html.escape(task_info['project_name'], quote=False)}</b>\n\n📋 <b>Задачи (кликните для изменения статуса):</b>\n"
+            keyboard = get_tasks_list_keyboard(tasks, project_id, has_more)
         
-        await callback.message.edit_text(
+        await edit_and_answer(
+            callback,
             message_text,
-            reply_markup=keyboard,
-            parse_mode=ParseMode.MARKDOWN
+            reply_markup=keyboard
         )
-        await callback.answer()
         
     except Exception as e:
-        logger.error(f"❌ Ошибка при возврате к списку задач: {e}")
+        logger.error("❌ Ошибка при возврате к списку задач: %s", e)
         await callback.answer("❌ Произошла ошибка")
 
 # Уведомления
-@dp.callback_query(F.data.startswith("notif_setting:"))
-async def set_notification_setting(callback: CallbackQuery):
+async def disable_all_notifications(user_id: int):
+    """Отключение всех неотправленных уведомлений пользователя"""
+    try:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(DISABLE_NOTIFICATIONS_SQL, user_id)
+    except Exception as e:
+        logger.error("❌ Ошибка отключения уведомлений %s: %s", user_id, e)
+
+async def set_notification_setting(callback: CallbackQuery, payload: str, state: FSMContext):
     """Настройка уведомлений"""
-    setting = callback.data.split(":")[1]
+    setting = payload
     
     try:
         if setting == "off":
-            # Отключаем все уведомления
-            pool = await get_db_pool()
-            async with pool.acquire() as conn:
-                await conn.execute('''
-                    UPDATE notifications SET is_sent = TRUE 
-                    WHERE user_id = $1 AND is_sent = FALSE
-                ''', callback.from_user.id)
-            
+            # Отвечаем сразу, а UPDATE по всем уведомлениям идёт в фоне
             await callback.answer("🔕 Все уведомления отключены")
+            spawn(disable_all_notifications(callback.from_user.id))
         else:
             days = int(setting)
             await callback.answer(f"✅ Уведомления будут приходить за {days} дня до дедлайна")
             
     except Exception as e:
-        logger.error(f"❌ Ошибка настройки уведомлений: {e}")
+        logger.error("❌ Ошибка настройки уведомлений: %s", e)
         await callback.answer("❌ Ошибка при настройке уведомлений")
 
-@dp.callback_query(F.data == "list_notifications")
-async def list_notifications(callback: CallbackQuery):
+async def list_notifications(callback: CallbackQuery, payload: str, state: FSMContext):
     """Список активных уведомлений"""
     user_id = callback.from_user.id
+    # Ответ идёт новым сообщением, поэтому нажатие подтверждаем сразу:
+    # ACK уходит в Telegram параллельно с запросом к БД
+    spawn(answer_in_background(callback))
     
     try:
         pool = await get_db_pool()
         async with pool.acquire() as conn:
-            notifications = await conn.fetch('''
-                SELECT n.*, t.title, t.deadline
-                FROM notifications n
-                JOIN tasks t ON n.task_id = t.id
-                JOIN projects p ON t.project_id = p.id
-                WHERE p.user_id = $1 AND n.is_sent = FALSE
-                ORDER BY n.notification_time
-                LIMIT 20
-            ''', user_id)
+            notifications = await conn.fetch(LIST_NOTIFICATIONS_SQL, user_id)
         
         if not notifications:
             message_text = "🔕 У вас нет активных уведомлений."
         else:
-            message_text = "🔔 **Ваши активные уведомления:**\n\n"
+            parts = ["🔔 <b>Ваши активные уведомления:</b>\n\n"]
             for notif in notifications:
-                time = notif['notification_time'].strftime('%d.%m.%Y %H:%M')
-                deadline = notif['deadline'].strftime('%d.%m.%Y')
-                days_left = (notif['deadline'] - datetime.now().date()).days
+                days_left = notif['days_left']
                 days_text = f" (через {days_left} дней)" if days_left > 0 else " (сегодня)" if days_left == 0 else f" (просрочено на {abs(days_left)} дней)"
                 
-                message_text += f"• **{notif['title']}**\n"
-                message_text += f"  ⏰ Уведомление: {time}\n"
-                message_text += f"  📅 Дедлайн: {deadline}{days_text}\n\n"
+                parts.append(
+                    f"• <b>{html.escape(notif['title'], quote=False)}</b>\n"
+                    f"  ⏰ Уведомление: {notif['notification_time_str']}\n"
+                    f"  📅 Дедлайн: {notif['deadline_str']}{days_text}\n\n"
+                )
+            message_text = "".join(parts)
         
-        await callback.message.answer(message_text, parse_mode=ParseMode.MARKDOWN)
-        await callback.answer()
+        await callback.message.answer(message_text)
         
     except Exception as e:
-        logger.error(f"❌ Ошибка при получении уведомлений: {e}")
-        await callback.answer("❌ Ошибка при получении уведомлений")
+        logger.error("❌ Ошибка при получении уведомлений: %s", e)
+        await callback.message.answer("❌ Ошибка при получении уведомлений")
 
 # Навигационные callback
-@dp.callback_query(F.data == "back_to_projects")
-async def back_to_projects(callback: CallbackQuery):
+async def back_to_projects(callback: CallbackQuery, payload: str, state: FSMContext):
     """Возврат к списку проектов"""
     try:
-        await show_projects(callback.message)
+        await show_projects(callback.message, state)
         await callback.answer()
     except Exception as e:
-        logger.error(f"❌ Ошибка при возврате к проектам: {e}")
+        logger.error("❌ Ошибка при возврате к проектам: %s", e)
         await callback.answer("❌ Ошибка")
 
-@dp.callback_query(F.data == "back_to_main")
-async def back_to_main(callback: CallbackQuery):
+async def back_to_main(callback: CallbackQuery, payload: str, state: FSMContext):
     """Возврат к главному меню"""
     try:
         await callback.message.answer("Используйте кнопки ниже:", reply_markup=get_main_keyboard())
         await callback.answer()
     except Exception as e:
-        logger.error(f"❌ Ошибка при возврате в главное меню: {e}")
+        logger.error("❌ Ошибка при возврате в главное меню: %s", e)
+
+# Ответ на неактивные кнопки всегда пустой: клиент Telegram может кешировать
+# его и не слать повторные нажатия той же кнопки в бота
+NOOP_CACHE_TIME = 30
 
 @dp.callback_query(F.data == "noop")
 async def noop_callback(callback: CallbackQuery):
     """Пустой callback для неактивных кнопок"""
-    await callback.answer()
+    await callback.answer(cache_time=NOOP_CACHE_TIME)
 
 # Удаление проекта
-@dp.callback_query(F.data.startswith("delete:"))
-async def delete_project(callback: CallbackQuery):
-    project_id = int(callback.data.split(":")[1])
+async def delete_project(callback: CallbackQuery, payload: str, state: FSMContext):
+    project_id = int(payload)
     user_id = callback.from_user.id
-    logger.info(f"🗑 Удаление проекта {project_id} от {user_id}")
+    logger.info("🗑 Удаление проекта %s от %s", project_id, user_id)
     
     try:
         pool = await get_db_pool()
         async with pool.acquire() as conn:
-            project = await conn.fetchrow(
-                "SELECT name FROM projects WHERE id = $1 AND user_id = $2",
-                project_id, user_id
-            )
-            
-            if not project:
-                await callback.answer("Проект не найден!")
-                return
-            
-            await conn.execute("DELETE FROM projects WHERE id = $1", project_id)
+            project_name = await conn.fetchval(DELETE_PROJECT_SQL, project_id, user_id)
         
-        await callback.message.edit_text(f"🗑 Проект '{project['name']}' удален.")
-        await callback.answer("✅ Проект удален!")
+        # Проекта нет или он чужой
+        if project_name is None:
+            await callback.answer("Проект не найден!")
+            return
+        
+        project_name_cache.pop((project_id, user_id), None)
+        await edit_and_answer(
+            callback,
+            f"🗑 Проект '{html.escape(project_name, quote=False)}' удален.",
+            answer_text="✅ Проект удален!"
+        )
         
     except Exception as e:
-        logger.error(f"❌ Ошибка при удалении проекта: {e}")
+        logger.error("❌ Ошибка при удалении проекта: %s", e)
         await callback.answer("❌ Произошла ошибка при удалении.")
 
 # Добавление задачи
-@dp.callback_query(F.data.startswith("add_task:"))
-async def start_add_task(callback: CallbackQuery, state: FSMContext):
-    project_id = int(callback.data.split(":")[1])
+async def start_add_task(callback: CallbackQuery, payload: str, state: FSMContext):
+    project_id = int(payload)
     user_id = callback.from_user.id
-    logger.info(f"➕ Добавление задачи в проект {project_id}")
+    logger.debug("➕ Добавление задачи в проект %s", project_id)
     
     try:
         pool = await get_db_pool()
         async with pool.acquire() as conn:
-            project = await conn.fetchrow(
-                "SELECT id, name FROM projects WHERE id = $1 AND user_id = $2",
-                project_id, user_id
-            )
+            project_name = await get_project_name(conn, project_id, user_id)
             
-            if not project:
-                await callback.answer("Проект не найден!")
-                return
-            
-            await state.update_data(project_id=project_id, project_name=project['name'])
+        if project_name is None:
+            await callback.answer("Проект не найден!")
+            return
+        
+        await state.update_data(project_id=project_id, project_name=project_name)
     
     except Exception as e:
-        logger.error(f"❌ Ошибка при проверке проекта: {e}")
+        logger.error("❌ Ошибка при проверке проекта: %s", e)
         await callback.answer("❌ Произошла ошибка.")
         return
     
-    await callback.message.answer(f"📝 Добавление задачи в проект '{project['name']}'\n\nНазвание задачи?")
+    await callback.message.answer(f"📝 Добавление задачи в проект '{project_name}'\n\nНазвание задачи?")
     await state.set_state(TaskState.waiting_for_title)
     await callback.answer()
 
+# Inline-кнопки: префикс callback_data до ":" ищется в словаре один раз,
+# вместо того чтобы прогонять апдейт через цепочку фильтров F.data.startswith.
+# Хендлер получает остаток callback_data после префикса (payload) уже отделённым
+CALLBACK_ROUTES = {
+    "tasks": show_tasks,
+    "task_statuses": show_task_statuses,
+    "task_detail": show_task_detail,
+    "set_status": set_task_status,
+    "remind": set_reminder,
+    "back_to_task_list": back_to_task_list,
+    "notif_setting": set_notification_setting,
+    "list_notifications": list_notifications,
+    "back_to_projects": back_to_projects,
+    "back_to_main": back_to_main,
+    "delete": delete_project,
+    "add_task": start_add_task,
+}
+
+@dp.callback_query()
+async def callback_router(callback: CallbackQuery, state: FSMContext):
+    """Диспетчер inline-кнопок по префиксу callback_data"""
+    prefix, _, payload = (callback.data or "").partition(":")
+    handler = CALLBACK_ROUTES.get(prefix)
+    if handler is None:
+        # Кнопка из старой версии бота: ответ тоже пустой и неизменный
+        await callback.answer(cache_time=NOOP_CACHE_TIME)
+        return
+    await handler(callback, payload, state)
+
 @dp.message(TaskState.waiting_for_title)
 async def process_task_title(message: Message, state: FSMContext):
     title = message.text.strip()
@@ -1226,27 +1913,32 @@ async def process_task_title(message: Message, state: FSMContext):
     await message.answer("📅 Дедлайн (ДД.ММ.ГГ, например: 05.02.26)?")
     await state.set_state(TaskState.waiting_for_deadline)
 
+# ДД.ММ.ГГ или ДД.ММ.ГГГГ; разбираем регуляркой вместо двух попыток strptime
+DEADLINE_RE = re.compile(r'(\d{1,2})\.(\d{1,2})\.(\d{2}|\d{4})')
+
 @dp.message(TaskState.waiting_for_deadline)
 async def process_task_deadline(message: Message, state: FSMContext):
     deadline_str = message.text.strip()
     
     # Валидация формата даты
     try:
-        for fmt in ('%d.%m.%y', '%d.%m.%Y'):
-            try:
-                deadline = datetime.strptime(deadline_str, fmt).date()
-                break
-            except ValueError:
-                continue
-        else:
+        match = DEADLINE_RE.fullmatch(deadline_str)
+        if not match:
             raise ValueError("Неверный формат даты")
+        
+        day, month, year = (int(part) for part in match.groups())
+        if year < 100:
+            # Как %y у strptime: 69-99 -> 19xx, 00-68 -> 20xx
+            year += 1900 if year >= 69 else 2000
+        # ValueError здесь — несуществующая дата вроде 31.02
+        deadline = date(year, month, day)
             
-        today = datetime.now().date()
+        today = TODAY.get()
         if deadline < today:
-            logger.warning(f"Дата в прошлом: {deadline_str}")
+            logger.warning("Дата в прошлом: %s", deadline_str)
             
     except ValueError as e:
-        logger.warning(f"Неверный формат даты: {deadline_str}")
+        logger.warning("Неверный формат даты: %s", deadline_str)
         await message.answer(
             "❌ Неверный формат даты. Попробуйте снова (ДД.ММ.ГГ или ДД.ММ.ГГГГ):"
         )
@@ -1258,41 +1950,42 @@ async def process_task_deadline(message: Message, state: FSMContext):
     try:
         pool = await get_db_pool()
         async with pool.acquire() as conn:
-            # Добавляем задачу в транзакции
-            async with conn.transaction():
-                # Добавляем задачу
-                result = await conn.fetchrow(
-                    "INSERT INTO tasks (project_id, title, deadline) VALUES ($1, $2, $3) RETURNING id",
-                    data['project_id'], data['title'], deadline
-                )
-                
-                task_id = result['id']
-                
-                # Автоматически создаем уведомления
-                notification_types = [
-                    ("days_before_3", 3),
-                    ("days_before_2", 2),
-                    ("days_before_1", 1),
-                    ("deadline_today", 0)
-                ]
-                
-                for notif_type, days in notification_types:
-                    await create_notification(message.from_user.id, task_id, notif_type, days)
+            # Задача (с прошедшим дедлайном сразу просрочена) и уведомления — один запрос
+            result = await conn.fetchrow(
+                ADD_TASK_SQL, data['project_id'], data['title'], deadline,
+                message.from_user.id, SCHEDULE_TYPES, SCHEDULE_DAYS
+            )
+        
+        if result['created']:
+            logger.info("📅 Уведомления созданы для задачи %s: %s", result['id'], ", ".join(result['created']))
+            # Выражение уже закоммичено, планировщик увидит новые строки
+            notifications_changed.set()
+        
+        # Уже прошедшие уведомления не создаются: перечисляем только реально установленные
+        created = set(result['created'])
+        labels = [label for notification_type, label in SCHEDULE_LABELS.items() if notification_type in created]
+        if labels:
+            reminders_text = f"🔔 Уведомления установлены: {', '.join(labels)}."
+        else:
+            reminders_text = "🔕 Уведомления не установлены: их время уже прошло."
         
         await message.answer(
-            f"✅ Задача '{data['title']}' добавлена в проект '{data['project_name']}'!\n\n"
+            f"✅ Задача '{html.escape(data['title'], quote=False)}' добавлена в проект '{data['project_name']}'!\n\n"
             f"📅 Дедлайн: {deadline.strftime('%d.%m.%Y')}\n"
-            f"🔔 Уведомления установлены за 3, 2, 1 день и в день дедлайна.",
+            f"{reminders_text}",
             reply_markup=get_main_keyboard()
         )
-        logger.info(f"✅ Задача добавлена в проект {data['project_id']}")
+        logger.info("✅ Задача добавлена в проект %s", data['project_id'])
         
     except Exception as e:
-        logger.error(f"❌ Ошибка при сохранении задачи: {e}")
+        logger.error("❌ Ошибка при сохранении задачи: %s", e)
         await message.answer("❌ Произошла ошибка при сохранении задачи.")
     
     await state.clear()
 
+# Все хендлеры объявлены выше статически, поэтому типы апдейтов вычисляем один раз
+ALLOWED_UPDATES = dp.resolve_used_update_types()
+
 # ========== WEBHOOK ЛОГИКА ==========
 async def on_startup(bot: Bot):
     """Установка вебхука при запуске"""
@@ -1306,78 +1999,88 @@ async def on_startup(bot: Bot):
         logger.info("🔄 Проверка данных из веб-версии...")
         result = await migrate_web_data()
         if result['success'] and result['projects_updated'] > 0:
-            logger.info(f"✅ Автоматически мигрировано {result['projects_updated']} проектов и {result['tasks_count']} задач")
+            logger.info("✅ Автоматически мигрировано %s проектов и %s задач", result['projects_updated'], result['tasks_count'])
         
         # Запускаем планировщик уведомлений
-        global notification_task
+        global notification_task, overdue_task, listener_task
+        listener_task = asyncio.create_task(notification_listener_loop())
         notification_task = asyncio.create_task(notification_scheduler())
+        overdue_task = asyncio.create_task(overdue_scheduler())
         
-        # Удаляем старый вебхук
-        try:
-            await bot.delete_webhook(drop_pending_updates=True)
-            logger.info("✅ Старый вебхук удален")
-        except Exception as e:
-            logger.warning(f"⚠️ Не удалось удалить вебхук: {e}")
-        
-        # Проверяем, есть ли уже установленный вебхук
+        # Один запрос вместо delete/get/set/get: если вебхук уже настроен как нужно,
+        # повторно его не трогаем
+        logger.info("✅ Типы апдейтов: %s", ", ".join(ALLOWED_UPDATES))
         webhook_info = await bot.get_webhook_info()
         
-        if webhook_info.url != WEBHOOK_URL:
-            # Устанавливаем новый вебхук
+        if (
+            webhook_info.url != WEBHOOK_URL
+            or webhook_info.max_connections != WEBHOOK_MAX_CONNECTIONS
+            or sorted(webhook_info.allowed_updates or []) != sorted(ALLOWED_UPDATES)
+        ):
+            # set_webhook атомарно заменяет прежний вебхук, удалять его отдельно не нужно
             await bot.set_webhook(
                 url=WEBHOOK_URL,
                 drop_pending_updates=True,
-                allowed_updates=dp.resolve_used_update_types(),
-                max_connections=40
+                allowed_updates=ALLOWED_UPDATES,
+                max_connections=WEBHOOK_MAX_CONNECTIONS
             )
-            logger.info(f"✅ Вебхук установлен: {WEBHOOK_URL}")
+            logger.info("✅ Вебхук установлен: %s", WEBHOOK_URL)
         else:
-            logger.info(f"✅ Вебхук уже установлен: {WEBHOOK_URL}")
-        
-        # Проверяем
-        webhook_info = await bot.get_webhook_info()
-        logger.info(f"✅ Информация о вебхуке: {webhook_info.url}")
-        logger.info(f"✅ Ожидающих обновлений: {webhook_info.pending_update_count}")
-        logger.info(f"✅ Последняя ошибка: {webhook_info.last_error_message or 'Нет'}")
+            logger.info("✅ Вебхук уже установлен: %s", WEBHOOK_URL)
+            logger.info("✅ Ожидающих обновлений: %s", webhook_info.pending_update_count)
+            logger.info("✅ Последняя ошибка: %s", webhook_info.last_error_message or 'Нет')
         
         logger.info("🎉 Бот запущен с уведомлениями и статусами!")
         
     except Exception as e:
-        logger.error(f"❌ Критическая ошибка при запуске: {e}")
+        logger.error("❌ Критическая ошибка при запуске: %s", e)
         logger.info("🔄 Пробуем продолжить без вебхука...")
 
 async def on_shutdown(bot: Bot):
     """Очистка при выключении"""
     logger.info("🛑 Остановка бота...")
     try:
-        # Останавливаем планировщик уведомлений
-        global notification_task
-        if notification_task:
-            notification_task.cancel()
-            try:
-                await notification_task
-            except asyncio.CancelledError:
-                pass
+        # Останавливаем планировщики
+        for task in (notification_task, overdue_task, listener_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        
+        # Даём фоновым запросам хендлеров дописать в БД до закрытия пула
+        if background_tasks:
+            await asyncio.gather(*background_tasks, return_exceptions=True)
         
         if db_pool:
             await db_pool.close()
         
         logger.info("✅ Ресурсы освобождены")
     except Exception as e:
-        logger.error(f"Ошибка при остановке: {e}")
+        logger.error("Ошибка при остановке: %s", e)
+
+class WebhookHandler(SimpleRequestHandler):
+    """Вебхук, который перестаёт принимать апдейты, когда очередь обработки полна"""
+    
+    async def handle(self, request: web.Request) -> web.Response:
+        # Telegram повторит доставку после не-2xx ответа, так что всплеск ждёт
+        # у него, а не копится задачами в памяти бота
+        if updates_pending >= MAX_UPDATES_PENDING:
+            logger.warning("⏳ Очередь апдейтов полна (%s), отвечаем 503", updates_pending)
+            return web.Response(status=503)
+        return await super().handle(request)
 
 # ========== HTTP ХЕНДЛЕРЫ ==========
+# Тело health check заранее закодировано: aiohttp сам проставит Content-Length
+HEALTH_BODY = b"OK"
+
 async def health_check(request):
     """Health check для Render"""
-    return web.Response(
-        text="OK",
-        status=200,
-        headers={"Content-Type": "text/plain"}
-    )
+    return web.Response(body=HEALTH_BODY, content_type="text/plain")
 
-async def home_page(request):
-    """Главная страница"""
-    html = f"""
+# Страница зависит только от конфигурации, поэтому рендерим её один раз
+HOME_PAGE_HTML = f"""
     <html>
     <head><title>Task Planner Pro</title></head>
     <body>
@@ -1392,11 +2095,43 @@ async def home_page(request):
     </body>
     </html>
     """
-    return web.Response(text=html, content_type="text/html")
+HOME_PAGE_BODY = HOME_PAGE_HTML.encode()
+# Сжимаем один раз при импорте — страницу дёргает мониторинг
+HOME_PAGE_GZIP = gzip.compress(HOME_PAGE_BODY, compresslevel=6)
+
+async def home_page(request):
+    """Главная страница"""
+    if "gzip" in request.headers.get("Accept-Encoding", ""):
+        return web.Response(
+            body=HOME_PAGE_GZIP,
+            content_type="text/html",
+            charset="utf-8",
+            headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"},
+        )
+    return web.Response(body=HOME_PAGE_BODY, content_type="text/html", charset="utf-8",
+                        headers={"Vary": "Accept-Encoding"})
 
 # ========== ОСНОВНАЯ ФУНКЦИЯ ==========
+async def run_server(app: web.Application):
+    """Запуск aiohttp-сервера через AppRunner/TCPSite"""
+    runner = web.AppRunner(app, handle_signals=True, access_log=None)
+    await runner.setup()
+    
+    # Большой backlog поглощает всплески доставки апдейтов от Telegram,
+    # reuse_port позволяет запустить несколько процессов на одном порту
+    site = web.TCPSite(runner, host="0.0.0.0", port=PORT, backlog=2048, reuse_port=True)
+    await site.start()
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
 def main():
     """Запуск приложения"""
+    # uvloop заметно быстрее стандартного цикла на keep-alive трафике Telegram и asyncpg
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    
     logger.info("🚀 Запуск Task Planner Pro...")
     
     # Регистрируем обработчики запуска/остановки
@@ -1407,9 +2142,10 @@ def main():
     app = web.Application()
     
     # Регистрируем вебхук
-    webhook_handler = SimpleRequestHandler(
+    webhook_handler = WebhookHandler(
         dispatcher=dp,
         bot=bot,
+        handle_in_background=True,
     )
     webhook_handler.register(app, path=WEBHOOK_PATH)
     
@@ -1421,19 +2157,16 @@ def main():
     setup_application(app, dp, bot=bot)
     
     # Запускаем сервер
-    logger.info(f"🚀 Запуск сервера на порту {PORT}")
-    logger.info(f"🌐 Вебхук: {WEBHOOK_URL}")
-    logger.info(f"👤 Используется Telegram ID: {TELEGRAM_USER_ID}")
+    logger.info("🚀 Запуск сервера на порту %s", PORT)
+    logger.info("🌐 Вебхук: %s", WEBHOOK_URL)
+    logger.info("👤 Используется Telegram ID: %s", TELEGRAM_USER_ID)
     
     try:
-        web.run_app(
-            app,
-            host="0.0.0.0",
-            port=PORT,
-            access_log=None
-        )
+        asyncio.run(run_server(app))
+    except (web.GracefulExit, KeyboardInterrupt):
+        logger.info("🛑 Сервер остановлен")
     except Exception as e:
-        logger.error(f"❌ Ошибка при запуске сервера: {e}")
+        logger.error("❌ Ошибка при запуске сервера: %s", e)
         sys.exit(1)
 
 if __name__ == "__main__":